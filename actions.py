@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+
+import requests
+
+import db
+import neynar
+
+log = logging.getLogger(__name__)
+
+# Ledger of outbound actions (follow, unfollow, like) in the actions table, see db.ensure_actions.
+# Every script checks it before calling the API, so an action that already went through is never
+# re-sent and a failed one is retried until MAX_ATTEMPTS. `target` is the cast hash for likes
+# and '' for follows.
+
+FOLLOW = "follow"
+UNFOLLOW = "unfollow"
+LIKE = "like"
+
+# Following and unfollowing cancel each other out: doing one clears the ledger entry for the other
+OPPOSITE = {FOLLOW: UNFOLLOW, UNFOLLOW: FOLLOW}
+
+MAX_ATTEMPTS = 5
+
+# Ledger.refresh re-reads rows this many seconds older than the newest it has seen
+REFRESH_OVERLAP_SECONDS = 300
+
+RECORD_SQL = '''
+INSERT INTO actions (fid, action, target, status, attempts, updated_at)
+VALUES (?, ?, ?, ?, 1, ?)
+ON CONFLICT(fid, action, target) DO UPDATE SET
+    status = excluded.status,
+    attempts = actions.attempts + 1,
+    updated_at = excluded.updated_at
+'''
+CLEAR_SQL = 'DELETE FROM actions WHERE fid = ? AND action = ? AND target = ?'
+
+
+# In-memory copy of the actions table. Reads happen on any thread (pipeline stages, crawler
+# workers, scheduler jobs); writes are queued on the caller's writer, so connections stay on their thread.
+class Ledger:
+    def __init__(self, conn, max_attempts=MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.in_flight = set()
+        self.refreshed_at = 0
+        self.refresh(conn)
+
+    # Pick up actions recorded by other processes since the last refresh. Only rows updated
+    # since then are read; the overlap covers rows stamped before another process's writer flushed them.
+    def refresh(self, conn):
+        rows = conn.execute(db.ACTIONS_SINCE_SQL, (self.refreshed_at - REFRESH_OVERLAP_SECONDS,)).fetchall()
+        with self.lock:
+            for fid, action, target, status, attempts, updated_at in rows:
+                if (fid, action, target) not in self.in_flight:
+                    self.entries[(fid, action, target)] = (status, attempts)
+                self.refreshed_at = max(self.refreshed_at, updated_at)
+
+    def done(self, fid, action, target=''):
+        with self.lock:
+            return self.entries.get((fid, action, target), (None, 0))[0] == 'done'
+
+    # True if the action should be sent now; the caller must record() the outcome.
+    # Claiming also stops a second worker in this run from sending the same action.
+    def claim(self, fid, action, target=''):
+        key = (fid, action, target)
+        with self.lock:
+            status, attempts = self.entries.get(key, (None, 0))
+            if status == 'done' or attempts >= self.max_attempts or key in self.in_flight:
+                return False
+            self.in_flight.add(key)
+            return True
+
+    def claim_many(self, fids, action, target=''):
+        return [fid for fid in fids if self.claim(fid, action, target)]
+
+    def record(self, writer, fid, action, ok, target=''):
+        key = (fid, action, target)
+        status = 'done' if ok else 'failed'
+        with self.lock:
+            self.in_flight.discard(key)
+            attempts = self.entries.get(key, (None, 0))[1] + 1
+            self.entries[key] = (status, attempts)
+            if ok and action in OPPOSITE:
+                self.entries.pop((fid, OPPOSITE[action], target), None)
+        writer.add(RECORD_SQL, (fid, action, target, status, int(time.time())))
+        if ok and action in OPPOSITE:
+            writer.add(CLEAR_SQL, (fid, OPPOSITE[action], target))
+
+    def record_many(self, writer, fids, action, ok, target=''):
+        for fid in fids:
+            self.record(writer, fid, action, ok, target)
+
+    # Drop claims that were never recorded (the call raised), so the action can be claimed again
+    def release_many(self, fids, action, target=''):
+        with self.lock:
+            for fid in fids:
+                self.in_flight.discard((fid, action, target))
+
+
+# Follow (or unfollow, with action=UNFOLLOW) in chunks of up to 100 target_fids per request,
+# skipping any the ledger says were already done or have failed too often. Each chunk's
+# users.following updates and ledger entries are committed in one transaction. A chunk whose
+# request fails in any way is recorded as failed; claims are released even if something
+# unexpected is raised. Returns the FIDs that succeeded.
+def follow_many(fids, writer, client, signer_uuid, ledger, action=FOLLOW):
+    following, method = (1, "POST") if action == FOLLOW else (0, "DELETE")
+    fids = ledger.claim_many(fids, action)
+    done = []
+    try:
+        for chunk in neynar.chunked(fids, neynar.FOLLOW_BATCH_LIMIT):
+            try:
+                succeeded, failed = client.follow_users_bulk(chunk, signer_uuid, method=method)
+            except requests.exceptions.RequestException as e:
+                log.warning("Error sending %s for users %d-%d: %s", action, chunk[0], chunk[-1], e)
+                ledger.record_many(writer, chunk, action, False)
+                writer.flush()
+                continue
+
+            writer.add_many('UPDATE users SET following = ? WHERE fid = ?', [(following, fid) for fid in succeeded])
+            ledger.record_many(writer, succeeded, action, True)
+            ledger.record_many(writer, failed, action, False)
+            writer.flush()
+            done.extend(succeeded)
+
+            log.info("%s succeeded for %d users", action.capitalize(), len(succeeded))
+            if failed:
+                log.warning("%s failed for users: %s", action.capitalize(), failed)
+    finally:
+        ledger.release_many(fids, action)
+    return done
@@ -1,84 +1,105 @@
-import sqlite3
-import requests
-import time
 from dotenv import load_dotenv
+import logging
 import os
+import time
+import checkpoint
+import crawler
+import db
+import discovery
+import metrics
+import neynar
+import ratelimit
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Get the FID from the environment variable
 viewer_fid = os.getenv("FARCASTER_DEVELOPER_FID")
 api_key = os.getenv("NEYNAR_API_KEY")
 
-# Initialize Database Connection
-conn = sqlite3.connect('farcaster_users.db')
-cursor = conn.cursor()
-
-# Create Table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    fid INTEGER PRIMARY KEY,
-    username TEXT,
-    follower_count INTEGER,
-    following_count INTEGER,
-    following BOOLEAN,
-    followed_by BOOLEAN,
-    activeStatus TEXT,
-    good_recent_cast TEXT,
-    liked_recent_cast INTEGER DEFAULT 0,
-    recently_active INTEGER DEFAULT 0, 
-    recent_cast_hash TEXT
-
-)
-''')
-
-# Function to Update Data into Database
-def update_user_data(user_data):
-    cursor.execute('''
-    UPDATE users
-    SET username = ?, follower_count = ?, following_count = ?, following = ?, followed_by = ?, activeStatus = ?
-    WHERE fid = ?
-    ''', (user_data['username'], user_data['followerCount'],
-          user_data['followingCount'], user_data['viewerContext']['following'],
-          user_data['viewerContext']['followedBy'], user_data['activeStatus'], user_data['fid']))
-    conn.commit()
-
-# Example API Call to Fetch and Update User Data
-def fetch_user_data(fid):
-    url = f"https://api.neynar.com/v1/farcaster/user?fid={fid}&viewerFid={viewer_fid}"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key  # Replace with your actual API key
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        user_data = response.json().get('result', {}).get('user', {})
-        update_user_data(user_data)
-        print(f"Data updated for FID {fid}.")
-    except requests.exceptions.HTTPError as e:
-        print(f"HTTP Error for FID {fid}: {e}")
-        if response.status_code == 429:  # Typically, 429 is the status code for rate limits
-            print("Rate limit hit. Waiting before next request...")
-            time.sleep(60)  # Wait for 60 seconds before the next request
-    except Exception as e:
-        print(f"Error fetching data for FID {fid}: {e}")
-
-# Fetch and Update Data for a Range of Users
-for fid in range(1, 25001):
-    fetch_user_data(fid)
-    time.sleep(0.01)  # Introduce a small delay between requests to avoid hitting rate limits
-
-for fid in range(187700, 193001):
-    fetch_user_data(fid)
-    time.sleep(0.02)  # Introduce a small delay between requests to avoid hitting rate limits
-
-
-# Query Database for Users Sorted by Follower Count
-cursor.execute('SELECT * FROM users ORDER BY follower_count DESC')
-for row in cursor.fetchall():
-    print(row)
-
-# Close Database Connection
-conn.close()
+# Crawl settings: how many FIDs are in flight at once and the request rate (per second)
+scan_concurrency = int(os.getenv("SCAN_CONCURRENCY", crawler.DEFAULT_CONCURRENCY))
+scan_rate = float(os.getenv("SCAN_RATE", ratelimit.DEFAULT_RATE))
+client = neynar.NeynarClient(api_key, pool_size=scan_concurrency, limiter=ratelimit.AdaptiveRateLimiter(scan_rate))
+
+# With SCAN_PROCESSES > 1 the scan fetches and parses in that many worker processes;
+# this process stays the only one writing to the database
+scan_processes = int(os.getenv("SCAN_PROCESSES", 1))
+
+# FID ranges swept by a full scan, checkpointed in scan_shards under SCAN_NAME
+SCAN_NAME = "profiles"
+SCAN_RANGES = [(1, 25001), (187700, 193001)]
+
+# SCAN_MODE=discover walks the follow graph from seed FIDs (see discovery.py) instead of sweeping SCAN_RANGES
+SCAN_MODE = os.getenv("SCAN_MODE", "ranges")
+
+# Fetch User Data for a batch of FIDs in one bulk request (runs in a crawler worker thread, no DB access here)
+# Errors propagate so the crawler can report the batch as failed
+def fetch_user_batch(fids):
+    return client.fetch_users_bulk(fids, viewer_fid)
+
+# Store fetched user data (runs on the crawler's main thread, which owns the connection)
+# Rows are upserted, so a scan over an empty database creates them
+def store_user_batch(fids, users, writer):
+    now = int(time.time())
+    writer.add_many(db.UPSERT_PROFILE_SQL, [db.profile_row(user_data) + (now,) for user_data in users])
+    log.debug("Data updated for %d of FIDs %d-%d.", len(users), fids[0], fids[-1])
+
+# Fetch and Update Data for a list of FIDs, 100 FIDs per request; returns the batches that failed
+def scan(conn, fids):
+    failed = []
+    writer = db.WriteBuffer(conn, batch_size=db.BULK_WRITE_BATCH_SIZE)
+    crawler.crawl(neynar.chunked(fids), fetch_user_batch,
+                  lambda batch, users: store_user_batch(batch, users, writer), concurrency=scan_concurrency,
+                  failed=failed)
+    writer.flush()
+    return failed
+
+# Pool process initializer: a fresh connection pool per process, sharing SCAN_RATE and
+# SCAN_CONCURRENCY between them
+def init_scan_process(processes):
+    global client
+    client = neynar.NeynarClient(api_key, pool_size=process_concurrency(processes),
+                                 limiter=ratelimit.AdaptiveRateLimiter(scan_rate / processes))
+
+# Requests each of `processes` pool processes keeps in flight
+def process_concurrency(processes):
+    return max(1, scan_concurrency // processes)
+
+def main():
+    metrics.start()
+
+    # Initialize Database Connection and create or upgrade the users table and its indexes
+    conn = db.connect()
+    cursor = conn.cursor()
+    db.migrate(conn)
+
+    # Fetch and Update Data for a Range of Users, resuming from the last finished shard.
+    # Run more copies of this script to split the remaining shards between them.
+    if SCAN_MODE == "discover":
+        fids = discovery.discover(conn, client, discovery.seed_fids(conn, viewer_fid), viewer_fid,
+                                  concurrency=scan_concurrency)
+        scan(conn, checkpoint.stale_among(conn, fids, "profile_refreshed_at"))
+    elif scan_processes > 1:
+        writer = db.WriteBuffer(conn, batch_size=db.BULK_WRITE_BATCH_SIZE)
+        checkpoint.run_scan_processes(conn, SCAN_NAME, SCAN_RANGES, fetch_user_batch,
+                                      lambda batch, results: store_user_batch(batch, results, writer), writer,
+                                      "profile_refreshed_at", scan_processes, process_concurrency(scan_processes),
+                                      init_scan_process, (scan_processes,))
+    else:
+        checkpoint.run_scan(conn, SCAN_NAME, SCAN_RANGES, scan, "profile_refreshed_at")
+    client.log_stats()
+
+    # Query Database for Users Sorted by Follower Count (only worth reading the table when it's shown)
+    if log.isEnabledFor(logging.DEBUG):
+        cursor.execute('SELECT * FROM users ORDER BY follower_count DESC')
+        for row in cursor.fetchall():
+            log.debug("%s", row)
+
+    # Close Database Connection
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# End-to-end throughput benchmark against the local Neynar stand-in (mock_neynar.py).
+# Runs the app.py scan, cronfollow.main_task and react.py on a throwaway database and
+# reports requests/sec, p50/p99 latency and time spent writing to SQLite for each.
+#   python bench.py --fids 10000 --latency 0.05 --rate 100
+
+
+def start_mock(args):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_neynar.py"),
+               "--port", str(args.port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+               "--rate", str(args.rate), "--error-rate", str(args.error_rate)]
+    mock = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    mock.stdout.readline()  # "Mock Neynar listening on ..."
+    return mock
+
+
+# Run fn(), silencing the scripts' per-item logging unless --verbose, and report the clients' numbers
+def measure(name, clients, fn, verbose, metrics):
+    for client in clients:
+        client.reset_stats()
+    rows, seconds = metrics.registry.value("db_rows_written_total"), metrics.registry.total("db_flush_seconds")
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.monotonic()
+    with output:
+        fn()
+    elapsed = time.monotonic() - started
+
+    requests = sum(count for client in clients for count, _, _ in client.stats.values())
+    p50 = max(client.latency_percentile(50) for client in clients)
+    p99 = max(client.latency_percentile(99) for client in clients)
+    print(f"{name}: {requests} requests in {elapsed:.2f}s ({requests / elapsed:.1f} req/s), "
+          f"p50 {p50 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms, "
+          f"{metrics.registry.value('db_rows_written_total') - rows} rows written in "
+          f"{metrics.registry.total('db_flush_seconds') - seconds:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against mock_neynar.py")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--fids", type=int, default=5000, help="FIDs covered by the app.py scan")
+    parser.add_argument("--likes", type=int, default=500, help="pending likes seeded for react.py")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--rate", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' own output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="followall-bench-")
+    # Must be set before the scripts are imported: they read their settings at import time
+    os.environ["NEYNAR_API_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["FARCASTER_DB"] = os.path.join(workdir, "bench.db")
+    os.environ["NEYNAR_CACHE_DB"] = os.path.join(workdir, "cache.db")
+    os.environ.setdefault("NEYNAR_API_KEY", "bench")
+    os.environ.setdefault("NEYNAR_FARCASTER_UUID", "bench-signer")
+    os.environ.setdefault("FARCASTER_DEVELOPER_FID", "2056")
+    os.environ.setdefault("NEYNAR_RATE", "1000")
+    os.environ.setdefault("SCAN_RATE", "1000")
+
+    mock = start_mock(args)
+    try:
+        import app
+        import cronfollow
+        import db
+        import metrics
+        import react
+
+        if args.verbose:
+            metrics.setup_logging("DEBUG")
+        conn = db.connect()
+        db.migrate(conn)
+        print(f"Benchmarking against {os.environ['NEYNAR_API_URL']} with {os.environ['FARCASTER_DB']}")
+
+        # The scan upserts, so it populates the empty users table itself
+        measure("app.scan", [app.client], lambda: app.scan(conn, list(range(1, args.fids + 1))), args.verbose, metrics)
+
+        measure("cronfollow.main_task", [cronfollow.client], cronfollow.main_task, args.verbose, metrics)
+
+        with conn:
+            conn.execute('UPDATE users SET liked_recent_cast = 0, good_recent_cast = NULL')
+            conn.execute('UPDATE users SET good_recent_cast = printf("0x%040x", fid) WHERE fid <= ?', (args.likes,))
+        measure("react.like_latest_casts", [react.client],
+                lambda: react.like_latest_casts(react.client, react.signer_uuid, until_idle=True), args.verbose, metrics)
+        conn.close()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
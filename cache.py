@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import db
+
+# Response cache for Neynar GETs, kept in its own SQLite file so crawler threads and scan
+# processes can read it without touching the users database (set NEYNAR_CACHE=0 to disable)
+CACHE_ENABLED = os.getenv("NEYNAR_CACHE", "1") != "0"
+CACHE_PATH = os.getenv("NEYNAR_CACHE_DB", "neynar_cache.db")
+
+# Seconds a cached response stays fresh, per endpoint; endpoints not listed are never cached
+CACHE_TTLS = {
+    "/v2/farcaster/user/bulk": int(os.getenv("NEYNAR_CACHE_TTL_USERS", 2 * 3600)),
+    "/v1/farcaster/user": int(os.getenv("NEYNAR_CACHE_TTL_USERS", 2 * 3600)),
+    "/v1/farcaster/casts": int(os.getenv("NEYNAR_CACHE_TTL_CASTS", 15 * 60)),
+}
+
+# Least recently used entries beyond this are evicted (checked every EVICT_EVERY writes)
+MAX_ENTRIES = int(os.getenv("NEYNAR_CACHE_MAX_ENTRIES", 200000))
+EVICT_EVERY = 1000
+
+
+# Cache key for a GET: the path plus its sorted query string
+def cache_key(path, params=None):
+    query = urlencode(sorted((params or {}).items()))
+    return f"{path}?{query}" if query else path
+
+
+# SQLite-backed TTL + LRU cache of response bodies with their ETags. One connection per
+# process, opened on first use and shared by its threads under a lock.
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttls=CACHE_TTLS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pid = None
+        self.writes = 0
+
+    def _connect(self):
+        # A connection inherited through fork isn't safe to use; reopen in the child
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = db.connect(self.path, check_same_thread=False)
+            self.conn.isolation_level = None  # autocommit: every statement is its own short transaction
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                etag TEXT,
+                fetched_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_used_at ON responses (last_used_at)')
+            self.pid = os.getpid()
+        return self.conn
+
+    def cacheable(self, path):
+        return path in self.ttls
+
+    # Returns (body, etag, fresh) for a cached response, or None
+    def get(self, path, key):
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute('SELECT body, etag, fetched_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute('UPDATE responses SET last_used_at = ? WHERE key = ?', (now, key))
+        body, etag, fetched_at = row
+        return body, etag, now - fetched_at < self.ttls.get(path, 0)
+
+    def put(self, path, key, body, etag=None):
+        self.put_many(path, [(key, body, etag)])
+
+    def put_many(self, path, entries):
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute('BEGIN')
+            conn.executemany('''
+            INSERT OR REPLACE INTO responses (key, endpoint, body, etag, fetched_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(key, path, body, etag, now, now) for key, body, etag in entries])
+            conn.execute('COMMIT')
+            self.writes += len(entries)
+            if self.writes >= EVICT_EVERY:
+                self.writes = 0
+                self._evict(conn)
+
+    # The server said 304 Not Modified: the cached body is fresh again
+    def touch(self, key):
+        now = time.time()
+        with self.lock:
+            self._connect().execute('UPDATE responses SET fetched_at = ?, last_used_at = ? WHERE key = ?',
+                                    (now, now, key))
+
+    # Drop every entry whose key starts with one of `prefixes` (a range scan on the primary key)
+    def invalidate(self, prefixes):
+        with self.lock:
+            self._connect().executemany('DELETE FROM responses WHERE key >= ? AND key < ?',
+                                        [(prefix, prefix + '\U0010ffff') for prefix in prefixes])
+
+    def _evict(self, conn):
+        excess = conn.execute('SELECT count(*) FROM responses').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('''
+            DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used_at LIMIT ?)
+            ''', (excess,))
+
+
+# Shared cache for every client in this process, or None when caching is turned off
+response_cache = ResponseCache() if CACHE_ENABLED else None
@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import crawler
+import neynar
+
+log = logging.getLogger(__name__)
+
+# FIDs per checkpointed shard; a crash loses at most one shard of work per worker
+SHARD_SIZE = int(os.getenv("SCAN_SHARD_SIZE", 1000))
+
+# A claimed shard whose worker hasn't finished it within this many seconds is handed to another worker
+LEASE_SECONDS = int(os.getenv("SCAN_LEASE_SECONDS", 900))
+
+# FIDs refreshed within this many hours are skipped, and finished shards aren't swept again until then
+TTL_HOURS = float(os.getenv("SCAN_TTL_HOURS", 24))
+
+
+# Name this process uses when claiming shards
+def worker_name():
+    return os.getenv("SCAN_WORKER") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+# Split [start, stop) ranges into shards of `size` FIDs
+def make_shards(ranges, size=SHARD_SIZE):
+    for start, stop in ranges:
+        for shard_start in range(start, stop, size):
+            yield shard_start, min(shard_start + size, stop)
+
+
+# Record the shards of a scan that aren't in the table yet. Once every shard is done, shards
+# finished more than TTL_HOURS ago go back to pending so the next run starts a new sweep.
+def plan_scan(conn, scan, ranges, size=SHARD_SIZE, ttl_hours=TTL_HOURS):
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('INSERT OR IGNORE INTO scan_shards (scan, start_fid, stop_fid) VALUES (?, ?, ?)',
+                         [(scan, start, stop) for start, stop in make_shards(ranges, size)])
+        unfinished = conn.execute("SELECT count(*) FROM scan_shards WHERE scan = ? AND status != 'done'",
+                                  (scan,)).fetchone()[0]
+        if not unfinished:
+            conn.execute('''
+            UPDATE scan_shards SET status = 'pending', claimed_by = NULL, claimed_at = NULL
+            WHERE scan = ? AND completed_at < ?
+            ''', (scan, int(time.time() - ttl_hours * 3600)))
+
+
+# Claim the next pending shard (or one whose lease ran out) for `worker`; returns (start, stop) or None.
+# BEGIN IMMEDIATE takes the write lock first, so two processes can never claim the same shard.
+def claim_shard(conn, scan, worker, lease_seconds=LEASE_SECONDS):
+    now = int(time.time())
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+        SELECT start_fid, stop_fid FROM scan_shards
+        WHERE scan = ? AND (status = 'pending' OR (status = 'claimed' AND claimed_at < ?))
+        ORDER BY start_fid LIMIT 1
+        ''', (scan, now - lease_seconds)).fetchone()
+        if row:
+            conn.execute('''
+            UPDATE scan_shards SET status = 'claimed', claimed_by = ?, claimed_at = ?
+            WHERE scan = ? AND start_fid = ?
+            ''', (worker, now, scan, row[0]))
+    return row
+
+
+def complete_shard(conn, scan, start):
+    with conn:
+        conn.execute('''
+        UPDATE scan_shards SET status = 'done', completed_at = ?
+        WHERE scan = ? AND start_fid = ?
+        ''', (int(time.time()), scan, start))
+
+
+# FIDs in [start, stop) whose `column` (a users refresh timestamp) is missing or older than the TTL
+def stale_fids(conn, start, stop, column, ttl_hours=TTL_HOURS):
+    cutoff = int(time.time() - ttl_hours * 3600)
+    fresh = {row[0] for row in conn.execute(f'SELECT fid FROM users WHERE fid >= ? AND fid < ? AND {column} >= ?',
+                                            (start, stop, cutoff))}
+    return [fid for fid in range(start, stop) if fid not in fresh]
+
+
+# The FIDs in `fids` (any order, e.g. from discovery) whose `column` is missing or older than the TTL
+def stale_among(conn, fids, column, ttl_hours=TTL_HOURS):
+    cutoff = int(time.time() - ttl_hours * 3600)
+    fresh = set()
+    for chunk in neynar.chunked(fids, 500):
+        fresh.update(row[0] for row in conn.execute(
+            f'SELECT fid FROM users WHERE fid IN ({", ".join("?" * len(chunk))}) AND {column} >= ?', (*chunk, cutoff)))
+    return [fid for fid in fids if fid not in fresh]
+
+
+# Work through a scan shard by shard: claim a shard, run scan_fids(conn, fids) on its stale FIDs
+# and mark it done. scan_fids must have committed its writes when it returns, so a finished
+# shard is never lost; start several processes to split a scan between them.
+# scan_fids returns the batches it couldn't fetch. A shard with failures stays claimed, and
+# another run picks it up once its lease has expired.
+def run_scan(conn, scan, ranges, scan_fids, ttl_column, worker=None, size=SHARD_SIZE):
+    worker = worker or worker_name()
+    plan_scan(conn, scan, ranges, size)
+    shards = failed_shards = 0
+    while True:
+        shard = claim_shard(conn, scan, worker)
+        if shard is None:
+            break
+        start, stop = shard
+        fids = stale_fids(conn, start, stop, ttl_column)
+        log.info("%s: shard %d-%d, %d FIDs to refresh", worker, start, stop - 1, len(fids))
+        if fids and scan_fids(conn, fids):
+            log.warning("%s: shard %d-%d had failed requests; leaving it for a retry", worker, start, stop - 1)
+            failed_shards += 1
+            continue
+        complete_shard(conn, scan, start)
+        shards += 1
+    log.info("%s: finished %d shards of %s, %d left for a retry", worker, shards, scan, failed_shards)
+    return shards
+
+
+# Process-pool variant of run_scan for when one process is CPU-bound on JSON parsing.
+# Each round claims one shard per process and crawls each shard's 100-FID batches in a pool
+# process with `concurrency` requests in flight; only this process touches the database:
+# store(batch, result) queues rows on `writer`, which is flushed before the round's shards are marked done.
+def run_scan_processes(conn, scan, ranges, fetch, store, writer, ttl_column, processes, concurrency=1,
+                       initializer=None, initargs=(), worker=None, size=SHARD_SIZE):
+    worker = worker or worker_name()
+    plan_scan(conn, scan, ranges, size)
+    shards = failed_shards = 0
+    with multiprocessing.Pool(processes, initializer, initargs) as pool:
+        while True:
+            claimed = []
+            for _ in range(processes):
+                shard = claim_shard(conn, scan, worker)
+                if shard is None:
+                    break
+                claimed.append(shard)
+            if not claimed:
+                break
+
+            groups = [list(neynar.chunked(stale_fids(conn, start, stop, ttl_column))) for start, stop in claimed]
+            log.info("%s: shards %d-%d, %d batches across %d processes",
+                     worker, claimed[0][0], claimed[-1][1] - 1, sum(map(len, groups)), processes)
+            failed = []
+            crawler.crawl_processes(pool, groups, fetch, store, failed, concurrency)
+            writer.flush()
+            for start, stop in claimed:
+                if any(start <= batch[0] < stop for batch in failed):
+                    log.warning("%s: shard %d-%d had failed requests; leaving it for a retry", worker, start, stop - 1)
+                    failed_shards += 1
+                    continue
+                complete_shard(conn, scan, start)
+                shards += 1
+    log.info("%s: finished %d shards of %s, %d left for a retry", worker, shards, scan, failed_shards)
+    return shards
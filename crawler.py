@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+# Short label for a log line: a batch of FIDs is shown as its first-last range
+def describe(item):
+    if isinstance(item, list) and item:
+        return f"{item[0]}-{item[-1]}"
+    return item
+
+# Default number of requests in flight for the FID range scans (override with SCAN_CONCURRENCY in .env)
+DEFAULT_CONCURRENCY = 16
+
+
+# Run fetch(fid) for every FID (or batch of FIDs) with at most `concurrency` requests in flight.
+# fetch runs in a worker thread and must only do HTTP work; store(fid, result) runs
+# on the event loop thread so sqlite connections are never shared across threads.
+# Items whose fetch raised are appended to `failed` when a list is given.
+async def crawl_async(fids, fetch, store=None, concurrency=DEFAULT_CONCURRENCY, failed=None):
+    loop = asyncio.get_running_loop()
+    fid_iter = iter(fids)
+    processed = 0
+
+    async def worker():
+        nonlocal processed
+        for fid in fid_iter:
+            try:
+                result = await loop.run_in_executor(executor, fetch, fid)
+            except Exception as e:
+                # One bad FID shouldn't stop the other workers
+                log.warning("Error fetching %s: %s", describe(fid), e)
+                if failed is not None:
+                    failed.append(fid)
+                result = None
+            if result is not None and store is not None:
+                store(fid, result)
+            processed += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return processed
+
+
+# Runs in a pool process: crawl one group of items with `concurrency` threads and hand
+# ([(item, result)], failed items) back to the parent
+def crawl_in_process(task):
+    fetch, items, concurrency = task
+    results, failed = [], []
+    asyncio.run(crawl_async(items, fetch, lambda item, result: results.append((item, result)), concurrency, failed))
+    return results, failed
+
+
+# Same contract as crawl_async, but each group of items is crawled in a process of a
+# multiprocessing pool, with up to `concurrency` requests in flight per process, so JSON parsing
+# is spread across cores without giving up concurrent requests. fetch must be a module-level
+# function (it is pickled); results come back to this process, where store() runs and owns the
+# sqlite connection.
+def crawl_processes(pool, groups, fetch, store=None, failed=None, concurrency=1):
+    processed = 0
+    for results, group_failed in pool.imap_unordered(crawl_in_process, [(fetch, items, concurrency) for items in groups]):
+        if failed is not None:
+            failed.extend(group_failed)
+        for item, result in results:
+            if store is not None:
+                store(item, result)
+        processed += len(results) + len(group_failed)
+    return processed
+
+
+def crawl(fids, fetch, store=None, concurrency=DEFAULT_CONCURRENCY, failed=None):
+    started = time.monotonic()
+    processed = asyncio.run(crawl_async(fids, fetch, store, concurrency, failed))
+    elapsed = time.monotonic() - started
+    log.info("Crawled %d items in %.1fs (%.1f items/s)", processed, elapsed, processed / max(elapsed, 1e-9))
+    return processed
@@ -1,94 +1,127 @@
 import requests
-import sqlite3
-import time
+import asyncio
 import datetime
+import logging
+import time
 from dotenv import load_dotenv
 import os
-from apscheduler.schedulers.blocking import BlockingScheduler
+import sqlite3
+import actions
+import crawler
+import db
+import fidset
+import followsync
+import metrics
+import neynar
+import pipeline
+import scoring
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Get the API Key from the environment variable
 api_key = os.getenv("NEYNAR_API_KEY")  # Ensure you have your API key in the .env file
 signer_uuid = os.getenv("NEYNAR_FARCASTER_UUID")
 viewer_fid = os.getenv("FARCASTER_DEVELOPER_FID")
 
-def fetch_recently_active_fids(api_key):
-    print("Fetching recently active FIDs...")
-    url = "https://api.neynar.com/v1/farcaster/recent-casts?viewerFid=2056&limit=100"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key
-    }
-    response = requests.get(url, headers=headers)
-    data = response.json()
-
-    active_fids = set()
-    total_reactions = 0
-    for cast in data['result']['casts']:
-        active_fids.update(cast['reactions']['fids'])
-        total_reactions += len(cast['reactions']['fids'])
-
-    print(f"Fetched {len(data['result']['casts'])} casts with a total of {total_reactions} reactions.")
-    
-    return active_fids
-
-def fetch_recent_cast_hash(fid, api_key):
-    url = f"https://api.neynar.com/v1/farcaster/casts?fid={fid}&limit=1"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key
-    }
-    response = requests.get(url, headers=headers)
-    data = response.json()
+# How many recent-cast lookups and likes run at once in the activity pipeline
+cast_refresh_concurrency = int(os.getenv("CAST_REFRESH_CONCURRENCY", crawler.DEFAULT_CONCURRENCY))
+
+# Threads that can hold a connection at the same time: the pipeline's casts and like stages and
+# the cast refresh job run cast_refresh_concurrency each; the profiles and follow stages and the
+# opt-out, follow sync, follow queue and like queue jobs one each
+pool_size = 3 * cast_refresh_concurrency + 6
+
+# Shared pooled connection used for every Neynar call
+client = neynar.NeynarClient(api_key, pool_size=pool_size)
+
+# Minutes between runs of each scheduled job: polling and the like/follow queues are cheap and
+# run often, the heavier refreshes less often. 0 disables a job, e.g. ACTIVITY_POLL_MINUTES=0
+# when webhook.py delivers activity instead.
+ACTIVITY_POLL_MINUTES = float(os.getenv("ACTIVITY_POLL_MINUTES", 1))
+CAST_REFRESH_MINUTES = float(os.getenv("CAST_REFRESH_MINUTES", 15))
+FOLLOW_QUEUE_MINUTES = float(os.getenv("FOLLOW_QUEUE_MINUTES", 5))
+LIKE_QUEUE_MINUTES = float(os.getenv("LIKE_QUEUE_MINUTES", 1))
+OPT_OUT_SYNC_MINUTES = float(os.getenv("OPT_OUT_SYNC_MINUTES", 30))
+FOLLOW_SYNC_MINUTES = float(os.getenv("FOLLOW_SYNC_MINUTES", 60))
+
+# Name of the recent-casts high-water mark in the poll_state table
+RECENT_CASTS_STATE = "recent-casts"
+
+# Users who like this cast are opted out of follows and likes
+OPT_OUT_CAST = "0x713ee58f1e803f22e505254a4c2f77e1d1c3e5cb"
+
+# Pipeline source: page through every cast since the last run and yield (fid, cast_hash) for each
+# newly seen reactor, recording them in the activity table as they arrive.
+# The (timestamp, hash) of the newest cast is left in state['high_water'] to be saved at the end.
+def fetch_recently_active_fids(client, writer, last_timestamp, last_hash, state):
+    log.info("Fetching recently active FIDs...")
+    seen = set()
+    total_casts = 0
+    for cast in client.iter_recent_casts_since(last_timestamp, last_hash):
+        if total_casts == 0:
+            state['high_water'] = (cast.get('timestamp'), cast.get('hash'))
+        total_casts += 1
+        new_fids = {fid: cast.get('hash') for fid in cast['reactions']['fids'] if fid not in seen}
+        seen.update(new_fids)
+        update_database_with_recently_active(writer, new_fids)
+        yield from new_fids.items()
+
+    log.info("Fetched %d new casts with %d active users.", total_casts, len(seen))
+
+# Pipeline stage: refresh username, counts and following/followed_by for a batch of up to 100
+# active FIDs in one request, yielding the users that haven't opted out
+def refresh_active_user_profiles(batch, client, writer, opt_out_fids):
+    fids = opt_out_fids.exclude(fid for fid, _ in batch)
+    if not fids:
+        return
+    users = client.fetch_users_bulk(fids, viewer_fid)
+    # Upserted, so users first seen through a webhook event get a row too
+    now = int(time.time())
+    writer.add_many(db.UPSERT_PROFILE_SQL, [db.profile_row(user_data) + (now,) for user_data in users])
+    log.debug("Refreshed profiles for %d recently active users.", len(users))
+    yield from users
+
+def fetch_recent_cast_hash(fid, client):
+    data = client.get_json("/v1/farcaster/casts", params={"fid": fid, "limit": 1})
     casts = data.get('result', {}).get('casts', [])
     if casts:
         return casts[0].get('hash')
     return None
 
-def update_recent_cast_hash_in_database(fid, recent_cast_hash, cursor, conn):
-    cursor.execute('UPDATE users SET recent_cast_hash = ? WHERE fid = ?', (recent_cast_hash, fid))
-    conn.commit()
-
-def clear_recently_active_column(cursor, conn):
-    cursor.execute("UPDATE users SET recently_active = 0")
-    conn.commit()
-
-def update_database_with_recently_active(cursor, conn, active_fids):
-    for fid in active_fids:
-        cursor.execute("UPDATE users SET recently_active = 1 WHERE fid = ?", (fid,))
-    conn.commit()
-
-def follow_user(fid, cursor, api_key, signer_uuid, conn):
-    url = "https://api.neynar.com/v2/farcaster/user/follow"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key,
-        "content-type": "application/json"
-    }
-    payload = {
-        "signer_uuid": signer_uuid,
-        "target_fids": [fid]
-    }
-
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        update_following_status(fid, cursor, conn)
+# Pipeline stage: look up the user's latest cast and pass on what the follow and like stages need
+def enrich_with_recent_cast(user_data, client, writer):
+    fid = user_data['fid']
+    recent_cast_hash = fetch_recent_cast_hash(fid, client)
+    if recent_cast_hash:
+        update_recent_cast_hash_in_database(fid, recent_cast_hash, writer)
+    yield fid, recent_cast_hash, user_data['viewerContext']['following'], user_data['viewerContext']['followedBy']
+
+def update_recent_cast_hash_in_database(fid, recent_cast_hash, writer):
+    writer.add('UPDATE users SET recent_cast_hash = ? WHERE fid = ?', (recent_cast_hash, fid))
+
+# Upsert the newly seen FIDs into the activity table; only these rows are touched
+def update_database_with_recently_active(writer, active_fids):
+    db.record_activity(writer, active_fids)
+
+# Follow users in chunks of up to 100 target_fids per request, marking each chunk in one transaction.
+# FIDs the ledger says we already followed (or gave up on) are skipped.
+def follow_users(fids, writer, client, signer_uuid, ledger):
+    for fid in actions.follow_many(fids, writer, client, signer_uuid, ledger):
         log_follow_action(fid)
-    except requests.exceptions.HTTPError as e:
-        print(f"Error following user {fid}: {e}")
 
-def like_cast(fid, cast_hash, api_key, signer_uuid):
-    print(f"Attempting to like cast {cast_hash} for user {fid}")
+# Like a cast unless the ledger says we already did, recording the outcome in the ledger.
+# users.liked_recent_cast tracks good_recent_cast (react.py's queue), so it's left alone here.
+def like_cast(fid, cast_hash, client, signer_uuid, writer, ledger):
+    if not ledger.claim(fid, actions.LIKE, cast_hash):
+        log.debug("Cast %s for user %d was already liked. Skipping.", cast_hash, fid)
+        return
+
+    log.debug("Attempting to like cast %s for user %d", cast_hash, fid)
 
-    url = "https://api.neynar.com/v2/farcaster/reaction"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key,
-        "content-type": "application/json"
-    }
     payload = {
         "signer_uuid": signer_uuid,
         "target": cast_hash,
@@ -96,156 +129,272 @@ def like_cast(fid, cast_hash, api_key, signer_uuid):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = client.post("/v2/farcaster/reaction", json=payload)
         response.raise_for_status()
-        print(f"Successfully liked cast {cast_hash} for user: {fid}")
-    except requests.exceptions.HTTPError as e:
-        print(f"Error liking cast {cast_hash} for user {fid}: {e}")
-
-def update_following_status(fid, cursor, conn):
-    cursor.execute('UPDATE users SET following = 1 WHERE fid = ?', (fid,))
-    conn.commit()
-
-def update_liked_cast_status(fid, cast_hash, cursor, conn):
-    cursor.execute('UPDATE users SET liked_recent_cast = 1 WHERE fid = ? AND recent_cast_hash = ?', (fid, cast_hash))
-    conn.commit()
+        log.debug("Successfully liked cast %s for user: %d", cast_hash, fid)
+        ledger.record(writer, fid, actions.LIKE, True, cast_hash)
+    except requests.exceptions.RequestException as e:
+        log.warning("Error liking cast %s for user %d: %s", cast_hash, fid, e)
+        ledger.record(writer, fid, actions.LIKE, False, cast_hash)
+    finally:
+        ledger.release_many([fid], actions.LIKE, cast_hash)
 
 def log_follow_action(fid):
-    timestamp = datetime.datetime.now()
-    print(f"{timestamp}: Followed user with FID {fid}")
-
-def follow_recently_active_users(cursor, api_key, signer_uuid, conn):
-    print("Processing recently active users...")
-    
-    # Select all recently active users, including opt-out status
-    cursor.execute('SELECT fid, recent_cast_hash, following, followed_by, opt_out FROM users WHERE recently_active = 1')
-    users_and_casts = cursor.fetchall()
-
-    if not users_and_casts:
-        print("No recently active users found.")
-        return
-
-    print(f"Found {len(users_and_casts)} recently active users.")
-
-    for fid, cast_hash, following, followed_by, opt_out in users_and_casts:
-        # Check if user has opted out
-        if opt_out == 1:
-            print(f"User {fid} has opted out. Skipping.")
-            continue
-
-        # Follow user if not already following and hasn't opted out
-        if following == 0:
-            follow_user(fid, cursor, api_key, signer_uuid, conn)
-
-        # Like cast if not already followed by the user and hasn't opted out
-        if followed_by == 0 and cast_hash:
-            print(f"User {fid} is not followed by us. Attempting to like recent cast: {cast_hash}")
-            like_cast(fid, cast_hash, api_key, signer_uuid)
+    log.debug("Followed user with FID %d", fid)
+
+# Pipeline stage: follow everyone in the batch we don't follow yet with one bulk request,
+# then pass on the users whose recent cast should be liked
+def follow_recently_active_users(batch, client, signer_uuid, writer, ledger):
+    fids_to_follow = [fid for fid, _, following, _ in batch if not following]
+    follow_users(fids_to_follow, writer, client, signer_uuid, ledger)
+
+    for fid, cast_hash, following, followed_by in batch:
+        # Like cast if not already followed by the user
+        if not followed_by and cast_hash:
+            yield fid, cast_hash
         else:
-            print(f"User {fid} is already followed by us or has no recent cast. Skipping.")
-        
-        time.sleep(1)  # Pause for 1 second between each action
-
-def update_opt_out_status(fid, opt_out_status, cursor, conn):
+            log.debug("User %d is already followed by us or has no recent cast. Skipping.", fid)
+
+# Pipeline stage: like one user's recent cast
+def like_recently_active_cast(item, client, signer_uuid, writer, ledger):
+    fid, cast_hash = item
+    log.debug("User %d is not followed by us. Attempting to like recent cast: %s", fid, cast_hash)
+    like_cast(fid, cast_hash, client, signer_uuid, writer, ledger)
+
+# Stream recently active users through fetch -> profile refresh -> recent cast -> follow -> like.
+# Each stage starts on the first items as soon as the previous stage produces them; bounded
+# queues between stages keep memory flat. Returns the recent-casts high-water mark to save, or None
+# when the casts couldn't all be read or some users were dropped by a failed stage.
+def process_recently_active_users(conn_writer, client, signer_uuid, opt_out_fids, last_timestamp, last_hash, ledger):
+    log.info("Processing recently active users...")
+    flow = pipeline.Pipeline()
+    state = {'high_water': None}
+
+    active_fids = flow.queue()
+    flow.source("fetch", lambda: fetch_recently_active_fids(client, flow.writer, last_timestamp, last_hash, state),
+                active_fids)
+    add_activity_stages(flow, active_fids, client, signer_uuid, opt_out_fids, ledger)
+
+    flow.run(conn_writer)
+    # A failed page leaves casts unread behind the newest one, and a failed stage drops its users
+    # (who may have no users row yet for the other jobs to find), so keep the old mark and re-read them next run
+    if flow.failed:
+        log.warning("%s failed; keeping the previous high-water mark.", ", ".join(sorted(flow.failed)))
+        return None
+    return state['high_water']
+
+# Stages that take (fid, cast_hash) items from `active_fids` through profile refresh, follow and like.
+# Shared by the recent-casts poller above and the webhook receiver (webhook.py).
+def add_activity_stages(flow, active_fids, client, signer_uuid, opt_out_fids, ledger):
+    writer = flow.writer
+    fid_batches = flow.queue()
+    users = flow.queue()
+    enriched = flow.queue()
+    follow_batches = flow.queue()
+    casts_to_like = flow.queue()
+
+    flow.batch("batch-profiles", active_fids, fid_batches, size=neynar.BULK_USER_LIMIT)
+    flow.stage("profiles", lambda batch: refresh_active_user_profiles(batch, client, writer, opt_out_fids),
+               fid_batches, users)
+    flow.stage("casts", lambda user_data: enrich_with_recent_cast(user_data, client, writer),
+               users, enriched, workers=cast_refresh_concurrency)
+    flow.batch("batch-follows", enriched, follow_batches, size=neynar.FOLLOW_BATCH_LIMIT)
+    flow.stage("follow", lambda batch: follow_recently_active_users(batch, client, signer_uuid, writer, ledger),
+               follow_batches, casts_to_like)
+    flow.stage("like", lambda item: like_recently_active_cast(item, client, signer_uuid, writer, ledger),
+               casts_to_like, workers=cast_refresh_concurrency)
+
+# Upsert the opt-out flag for many users in one statement
+def update_opt_out_status(fids, opt_out_status, writer):
+    writer.add_many(db.UPSERT_OPT_OUT_SQL, [(fid, opt_out_status) for fid in fids])
+
+
+# Page through every like of the opt-out cast since the last check and upsert the likers.
+# The newest like seen is kept in poll_state so the next run only reads new likes.
+def fetch_and_update_opt_out_users(client, cast_hash, writer, conn):
+    state = f"opt-out:{cast_hash}"
+    since, _ = db.get_poll_state(conn, state)
     try:
-        query = "UPDATE users SET opt_out = ? WHERE fid = ?"
-        cursor.execute(query, (opt_out_status, fid))
-        conn.commit()
-        print(f"Updated opt-out status for FID {fid} to {opt_out_status}")
-    except Exception as e:
-        print(f"Failed to update opt-out status for FID {fid}: {e}")
-        conn.rollback()
-
-
-def fetch_and_update_opt_out_users(api_key, cast_hash, cursor, conn):
-    url = f"https://api.neynar.com/v1/farcaster/cast-likes?castHash={cast_hash}&viewerFid=2056&limit=25"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key
-    }
-
-    response = requests.get(url, headers=headers)
-    if response.status_code != 200:
-        print(f"Failed to fetch likes for cast {cast_hash}: {response.status_code}")
+        likes = list(client.iter_cast_likes(cast_hash, since))
+    except requests.exceptions.RequestException as e:
+        log.warning("Failed to fetch likes for cast %s: %s", cast_hash, e)
         return
 
-    data = response.json()
-
-    # Extract FIDs from the nested structure
-    liked_fids = [like['reactor']['fid'] for like in data.get('result', {}).get('likes', [])]
-
+    liked_fids = {like['reactor']['fid'] for like in likes}
     if not liked_fids:
-        print(f"No likes found for cast {cast_hash}.")
+        log.info("No new likes found for cast %s.", cast_hash)
+        return
+
+    update_opt_out_status(liked_fids, 1, writer)
+    try:
+        writer.flush()
+    except sqlite3.Error as e:
+        log.error("Failed to update opt-out status for cast %s: %s", cast_hash, e)
         return
+    if likes[0].get('timestamp'):
+        db.set_poll_state(conn, state, likes[0]['timestamp'], str(likes[0]['reactor']['fid']))
 
-    for fid in liked_fids:
-        # Update opt-out status
-        update_opt_out_status(fid, 1, cursor, conn)
+    log.info("Updated opt-out status for %d users based on likes for cast %s.", len(liked_fids), cast_hash)
 
-    print(f"Updated opt-out status for {len(liked_fids)} users based on likes for cast {cast_hash}.")
+# Everyone who has opted out, as an in-memory bitmap checked before any per-user SQL or HTTP work
+def load_opt_out_fids(conn):
+    return fidset.FidBitmap(row[0] for row in conn.execute(db.OPT_OUT_SQL))
 
 
 
-def like_recent_casts(cursor, api_key, signer_uuid, conn):
-    print("Checking for casts to like...")
-    cursor.execute('SELECT fid, recent_cast_hash, opt_out FROM users WHERE recent_cast_hash IS NOT NULL AND liked_recent_cast = 0 AND following = 1 AND followed_by = 0')
+def like_recent_casts(cursor, client, signer_uuid, writer, ledger, opt_out_fids):
+    log.info("Checking for casts to like...")
+    cursor.execute(db.LIKE_CANDIDATES_SQL)
     users_and_casts = cursor.fetchall()
-    
+
     if not users_and_casts:
-        print("No recent casts found to like.")
+        log.info("No recent casts found to like.")
         return
 
-    print(f"Found {len(users_and_casts)} recent casts to potentially like.")
-    for fid, cast_hash, opt_out in users_and_casts:
-        # Check if user has opted out
-        if opt_out == 1:
-            print(f"User {fid} has opted out. Skipping like.")
-            continue
-
-        print(f"Checking if cast {cast_hash} from user {fid} can be liked...")
-        like_cast(fid, cast_hash, api_key, signer_uuid)
-        time.sleep(1)  # Pause for 1 second between each like request
-
+    log.info("Found %d recent casts to potentially like.", len(users_and_casts))
+    # Skip users who opted out and casts the ledger (keyed by cast hash, so a new cast is a new
+    # candidate) says we already liked, then like the likeliest follow-backs first
+    cast_hashes = {fid: cast_hash for fid, cast_hash in users_and_casts
+                   if fid not in opt_out_fids and not ledger.done(fid, actions.LIKE, cast_hash)}
+    for fid in scoring.best(cursor.connection, list(cast_hashes), scoring.LIKE_BUDGET):
+        log.debug("Checking if cast %s from user %d can be liked...", cast_hashes[fid], fid)
+        like_cast(fid, cast_hashes[fid], client, signer_uuid, writer, ledger)
+
+# Run the opt-out, follow sync, activity and like jobs once, in order, on one connection (the scheduler in
+# __main__ runs them, plus the cast refresh and follow queue, on separate intervals)
 def main_task():
-    print("Main task started.")
-    # Initialize Database Connection
-    conn = sqlite3.connect('farcaster_users.db')
-    cursor = conn.cursor()
-
-    # Usage example (within the main task or another appropriate place):
-    fetch_and_update_opt_out_users(api_key, "0x713ee58f1e803f22e505254a4c2f77e1d1c3e5cb", cursor, conn)
-
-
-    # Clear the recently_active column
-    clear_recently_active_column(cursor, conn)
-
-    # Fetch and Update Recently Active Users
-    active_fids = fetch_recently_active_fids(api_key)
-    update_database_with_recently_active(cursor, conn, active_fids)
-
-    #  Fetch and update recent cast hashes for recently active users
-    for fid in active_fids:
-        recent_cast_hash = fetch_recent_cast_hash(fid, api_key)
-        if recent_cast_hash:
-            update_recent_cast_hash_in_database(fid, recent_cast_hash, cursor, conn)
-
-    # Follow Recently Active Users and Like their Recent Casts
-    follow_recently_active_users(cursor, api_key, signer_uuid, conn)
-
-    # Like Recent Casts of Followed Users Who Aren't Following Back
-    like_recent_casts(cursor, api_key, signer_uuid, conn)
+    log.info("Main task started.")
+    with metrics.timed("stage_seconds", stage="main_task"):
+        # Initialize Database Connection; row updates are buffered and committed in batches
+        conn = db.connect()
+        writer = db.WriteBuffer(conn)
+        db.migrate(conn)
+        ledger = actions.Ledger(conn)
+
+        # Sync opt-outs from the likes of the opt-out cast
+        with metrics.timed("stage_seconds", stage="opt_out"):
+            opt_out_job(conn, writer)
+
+        # Refresh following/followed_by from our own follow lists
+        with metrics.timed("stage_seconds", stage="follow_sync"):
+            follow_sync_job(conn, writer)
+
+        # Stream Recently Active Users through profile refresh, follow and like
+        with metrics.timed("stage_seconds", stage="recently_active"):
+            activity_job(conn, writer, ledger)
+
+        # Like Recent Casts of Followed Users Who Aren't Following Back
+        with metrics.timed("stage_seconds", stage="like_recent_casts"):
+            like_queue_job(conn, writer, ledger)
+
+        # Close Database Connection
+        writer.flush()
+        conn.close()
+
+    client.log_stats()
+    if metrics.METRICS_JSON:
+        metrics.dump_json()
+    log.info("Task completed at %s", datetime.datetime.now())
+
+
+# Run one scheduled job with its own connection and write buffer, timed into stage_seconds.
+# Jobs run on scheduler threads, so each needs a connection of its own.
+def run_job(name, work):
+    with metrics.timed("stage_seconds", stage=name):
+        conn = db.connect()
+        writer = db.WriteBuffer(conn)
+        try:
+            work(conn, writer)
+            writer.flush()
+        finally:
+            conn.close()
+
+# Job: record likers of the opt-out cast
+def opt_out_job(conn, writer):
+    fetch_and_update_opt_out_users(client, OPT_OUT_CAST, writer, conn)
+
+# Job: reconcile following/followed_by with our own follow lists. A failed sync changes nothing
+# and is retried next run; it must not stop the activity and like jobs after it in main_task.
+def follow_sync_job(conn, writer):
+    fid = followsync.parse_fid(viewer_fid)
+    if fid is None:
+        log.warning("FARCASTER_DEVELOPER_FID is not set to a FID; skipping the follow sync.")
+        return
+    try:
+        followsync.sync_follow_state(conn, client, fid)
+    except requests.exceptions.RequestException as e:
+        log.warning("Failed to fetch our follow lists: %s", e)
+    except sqlite3.Error as e:
+        log.error("Failed to update follow state: %s", e)
+
+# Job: poll casts since the last run and stream their reactors through profile refresh, follow and like
+def activity_job(conn, writer, ledger):
+    ledger.refresh(conn)
+    opt_out_fids = load_opt_out_fids(conn)
+    last_timestamp, last_hash = db.get_poll_state(conn, RECENT_CASTS_STATE)
+    high_water = process_recently_active_users(writer, client, signer_uuid, opt_out_fids, last_timestamp,
+                                               last_hash, ledger)
+    if high_water:
+        db.set_poll_state(conn, RECENT_CASTS_STATE, *high_water)
+
+# Job: refresh the recent cast of everyone active within the activity window
+def cast_refresh_job(conn, writer):
+    opt_out_fids = load_opt_out_fids(conn)
+    fids = opt_out_fids.exclude(row[0] for row in conn.execute(db.ACTIVE_USERS_SQL, (db.active_since(),)))
+    crawler.crawl(fids, lambda fid: fetch_recent_cast_hash(fid, client),
+                  lambda fid, cast_hash: update_recent_cast_hash_in_database(fid, cast_hash, writer),
+                  concurrency=cast_refresh_concurrency)
+
+# Job: follow recently active users we don't follow yet (catches anything the activity job missed)
+def follow_queue_job(conn, writer, ledger):
+    ledger.refresh(conn)
+    opt_out_fids = load_opt_out_fids(conn)
+    fids = opt_out_fids.exclude(row[0] for row in conn.execute(db.RECENT_FOLLOW_CANDIDATES_SQL, (db.active_since(), 0)))
+    follow_users(scoring.best(conn, fids, scoring.FOLLOW_BUDGET), writer, client, signer_uuid, ledger)
+
+# Job: like recent casts of followed users who aren't following back
+def like_queue_job(conn, writer, ledger):
+    ledger.refresh(conn)
+    like_recent_casts(conn.cursor(), client, signer_uuid, writer, ledger, load_opt_out_fids(conn))
+
+# Every job starts now, then repeats on its own interval. max_instances=1 stops a slow run from
+# overlapping the next one, and coalesce=True folds runs missed meanwhile into a single run.
+def schedule_jobs(scheduler, ledger):
+    now = datetime.datetime.now()
+    jobs = [
+        ("opt_out_sync", lambda conn, writer: opt_out_job(conn, writer), OPT_OUT_SYNC_MINUTES),
+        ("follow_sync", lambda conn, writer: follow_sync_job(conn, writer), FOLLOW_SYNC_MINUTES),
+        ("activity_poll", lambda conn, writer: activity_job(conn, writer, ledger), ACTIVITY_POLL_MINUTES),
+        ("cast_refresh", lambda conn, writer: cast_refresh_job(conn, writer), CAST_REFRESH_MINUTES),
+        ("follow_queue", lambda conn, writer: follow_queue_job(conn, writer, ledger), FOLLOW_QUEUE_MINUTES),
+        ("like_queue", lambda conn, writer: like_queue_job(conn, writer, ledger), LIKE_QUEUE_MINUTES),
+    ]
+    for name, work, minutes in jobs:
+        if minutes <= 0:
+            log.info("Job %s is disabled.", name)
+            continue
+        scheduler.add_job(run_job, 'interval', args=(name, work), id=name, name=name, minutes=minutes,
+                          next_run_time=now, max_instances=1, coalesce=True, misfire_grace_time=60)
+        log.info("Scheduled %s every %g minutes.", name, minutes)
 
 
+if __name__ == "__main__":
+    metrics.start()
 
-    # Close Database Connection
+    # Create or upgrade the schema once, and share one action ledger between the jobs
+    conn = db.connect()
+    db.migrate(conn)
+    ledger = actions.Ledger(conn)
     conn.close()
 
-    print(f"Task completed at {datetime.datetime.now()}")
-
-
-# Scheduler to run the task immediately and then every 5 minutes
-scheduler = BlockingScheduler()
-scheduler.add_job(main_task, 'interval', minutes=75, next_run_time=datetime.datetime.now())
-
-print("Scheduler started. Running the task immediately and then every 5 minutes.")
-scheduler.start()
\ No newline at end of file
+    # Jobs run in the event loop's thread pool, so a slow job never holds up the others
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    scheduler = AsyncIOScheduler(event_loop=loop)
+    schedule_jobs(scheduler, ledger)
+    scheduler.start()
+    log.info("Scheduler started.")
+    try:
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        scheduler.shutdown()
\ No newline at end of file
@@ -0,0 +1,400 @@
+import logging
+import os
+import sqlite3
+import time
+
+import likequeue
+import metrics
+
+log = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("FARCASTER_DB", 'farcaster_users.db')
+
+# Flush the write buffer after this many rows or this many seconds, whichever comes first
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL = 2.0
+# Larger batches for the bulk scans, which upsert a 100-user page at a time
+BULK_WRITE_BATCH_SIZE = 5000
+
+# A user counts as recently active if we've seen them react within this many minutes
+RECENTLY_ACTIVE_MINUTES = int(os.getenv("RECENTLY_ACTIVE_MINUTES", 120))
+
+# An upserted row whose fields are unchanged keeps its refresh timestamps unless they are older
+# than this; keep it below SCAN_TTL_HOURS so unchanged users still drop out of the next sweep
+RESTAMP_SECONDS = int(os.getenv("RESTAMP_SECONDS", 3600))
+
+
+# Open the users database with WAL journaling and pragmas tuned for bulk writes.
+# synchronous=NORMAL is safe with WAL: a crash can lose the last transaction but never corrupts the file.
+def connect(path=DB_PATH, check_same_thread=True):
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -64000")  # 64 MB page cache
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+# Collects row writes and applies them with executemany, one transaction per flush.
+# Consecutive rows for the same statement are grouped, so statement order is preserved.
+class WriteBuffer:
+    def __init__(self, conn, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []  # list of [sql, [params, ...]]
+        self.count = 0
+        self.rows_written = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, sql, params=()):
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].append(params)
+        else:
+            self.pending.append([sql, [params]])
+        self.count += 1
+        if self.count >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Queue many rows for one statement; they land in the same transaction
+    def add_many(self, sql, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        if self.pending and self.pending[-1][0] == sql:
+            self.pending[-1][1].extend(rows)
+        else:
+            self.pending.append([sql, rows])
+        self.count += len(rows)
+        if self.count >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, []
+        count, self.count = self.count, 0
+        with metrics.timed("db_flush_seconds"):
+            with self.conn:  # commits on success, rolls back the whole batch on error
+                for sql, rows in pending:
+                    self.conn.executemany(sql, rows)
+        self.rows_written += count
+        metrics.inc("db_rows_written_total", count)
+        metrics.inc("db_flushes_total")
+        return count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+
+# High-water marks for incremental polling (e.g. the newest recent-cast seen so far)
+def ensure_poll_state(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS poll_state (
+        name TEXT PRIMARY KEY,
+        last_timestamp TEXT,
+        last_hash TEXT,
+        updated_at TEXT
+    )
+    ''')
+
+
+def get_poll_state(conn, name):
+    ensure_poll_state(conn)
+    row = conn.execute('SELECT last_timestamp, last_hash FROM poll_state WHERE name = ?', (name,)).fetchone()
+    return row if row else (None, None)
+
+
+def set_poll_state(conn, name, last_timestamp, last_hash):
+    ensure_poll_state(conn)
+    with conn:
+        conn.execute('''
+        INSERT INTO poll_state (name, last_timestamp, last_hash, updated_at)
+        VALUES (?, ?, ?, datetime('now'))
+        ON CONFLICT(name) DO UPDATE SET
+            last_timestamp = excluded.last_timestamp,
+            last_hash = excluded.last_hash,
+            updated_at = excluded.updated_at
+        ''', (name, last_timestamp, last_hash))
+
+
+# One row per FID we've seen reacting: when we first and last saw them, the cast they reacted to
+# and how many polls they've shown up in. Times are unix epoch seconds.
+def ensure_activity(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS activity (
+        fid INTEGER PRIMARY KEY,
+        first_seen_at INTEGER NOT NULL,
+        last_seen_at INTEGER NOT NULL,
+        source_cast TEXT,
+        seen_count INTEGER NOT NULL DEFAULT 1
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_activity_last_seen_at ON activity (last_seen_at)')
+
+
+UPSERT_ACTIVITY_SQL = '''
+INSERT INTO activity (fid, first_seen_at, last_seen_at, source_cast)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(fid) DO UPDATE SET
+    last_seen_at = max(activity.last_seen_at, excluded.last_seen_at),
+    source_cast = excluded.source_cast,
+    seen_count = activity.seen_count + 1
+'''
+
+
+# Queue an upsert for every active FID; `activity` maps fid -> hash of the cast they reacted to
+def record_activity(writer, activity, seen_at=None):
+    seen_at = int(seen_at or time.time())
+    writer.add_many(UPSERT_ACTIVITY_SQL, [(fid, seen_at, seen_at, cast_hash) for fid, cast_hash in activity.items()])
+
+
+# Cut-off for "recently active" time-window queries: activity.last_seen_at >= active_since()
+def active_since(minutes=RECENTLY_ACTIVE_MINUTES):
+    return int(time.time()) - minutes * 60
+
+
+# Checkpoints for the range scans: one row per shard of FIDs, claimed by one worker at a time
+# (pending -> claimed -> done). See checkpoint.py.
+def ensure_scan_shards(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS scan_shards (
+        scan TEXT NOT NULL,
+        start_fid INTEGER NOT NULL,
+        stop_fid INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        claimed_by TEXT,
+        claimed_at INTEGER,
+        completed_at INTEGER,
+        PRIMARY KEY (scan, start_fid)
+    )
+    ''')
+
+
+# Durable queue of casts to like, consumed by the react.py worker (see likequeue.py)
+def ensure_like_queue(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS like_queue (
+        fid INTEGER NOT NULL,
+        cast_hash TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        enqueued_at INTEGER NOT NULL,
+        claimed_at INTEGER,
+        acked_at INTEGER,
+        PRIMARY KEY (fid, cast_hash)
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_like_queue_status ON like_queue (status, enqueued_at)')
+
+
+# Frontier and visited set of the graph walk in discovery.py
+def ensure_discovery(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS discovery (
+        fid INTEGER PRIMARY KEY,
+        priority REAL NOT NULL DEFAULT 0,
+        depth INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        discovered_at INTEGER NOT NULL,
+        visited_at INTEGER
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_discovery_frontier ON discovery (status, priority)')
+
+
+# Ledger of every follow, unfollow and like we've sent and how it went (see actions.py)
+def ensure_actions(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS actions (
+        fid INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        target TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (fid, action, target)
+    )
+    ''')
+    # Earlier versions led this index with action, which Ledger.refresh's range query can't use
+    if 'action' in [row[2] for row in conn.execute("PRAGMA index_info('idx_actions_updated_at')")]:
+        conn.execute('DROP INDEX idx_actions_updated_at')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_actions_updated_at ON actions (updated_at)')
+
+
+# Full users schema; older databases are brought up to date by migrate()
+USERS_COLUMNS = [
+    ("username", "TEXT"),
+    ("follower_count", "INTEGER"),
+    ("following_count", "INTEGER"),
+    ("following", "BOOLEAN"),
+    ("followed_by", "BOOLEAN"),
+    ("activeStatus", "TEXT"),
+    ("good_recent_cast", "TEXT"),
+    ("liked_recent_cast", "INTEGER DEFAULT 0"),
+    ("recently_active", "INTEGER DEFAULT 0"),
+    ("recent_cast_hash", "TEXT"),
+    ("opt_out", "INTEGER DEFAULT 0"),
+    ("profile_refreshed_at", "INTEGER"),  # epoch seconds of the last profile fetch
+    ("cast_refreshed_at", "INTEGER"),  # epoch seconds of the last recent-cast fetch
+]
+
+# Secondary indexes backing the targeting queries below
+USERS_INDEXES = [
+    # like_recent_casts / unfollow: following = 1 AND followed_by = 0
+    'CREATE INDEX IF NOT EXISTS idx_users_follow_state ON users '
+    '(following, followed_by, liked_recent_cast, recent_cast_hash, opt_out)',
+    # followerscript: following = 0 AND follower_count > ? AND following_count > ?
+    'CREATE INDEX IF NOT EXISTS idx_users_follow_candidates ON users '
+    '(following, follower_count, following_count)',
+    # cronfollow: the opt-out set loaded into memory each run
+    'CREATE INDEX IF NOT EXISTS idx_users_opt_out ON users (opt_out)',
+    # followsync: followed_by = 1. Partial, so unfollow's followed_by = 0 keeps idx_users_follow_state
+    'CREATE INDEX IF NOT EXISTS idx_users_followed_by ON users (followed_by) WHERE followed_by = 1',
+    # react: liked_recent_cast = 0 AND good_recent_cast IS NOT NULL
+    'CREATE INDEX IF NOT EXISTS idx_users_pending_likes ON users '
+    '(liked_recent_cast, good_recent_cast)',
+]
+
+# INSERT ... ON CONFLICT(fid) DO UPDATE for the users table: creates missing rows and refreshes
+# existing ones. The DO UPDATE only fires when one of `columns` changed or a `stamps` timestamp is
+# older than RESTAMP_SECONDS, so re-scanning unchanged users writes nothing.
+# Parameters are (fid, *columns, *stamps).
+def users_upsert_sql(columns, stamps=()):
+    names = ("fid",) + tuple(columns) + tuple(stamps)
+    changed = [f"users.{name} IS NOT excluded.{name}" for name in columns]
+    changed += [f"users.{name} IS NULL OR users.{name} < excluded.{name} - {RESTAMP_SECONDS}" for name in stamps]
+    return f'''
+INSERT INTO users ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})
+ON CONFLICT(fid) DO UPDATE SET {", ".join(f"{name} = excluded.{name}" for name in names[1:])}
+WHERE {" OR ".join(changed)}
+'''
+
+PROFILE_COLUMNS = ("username", "follower_count", "following_count", "following", "followed_by", "activeStatus")
+UPSERT_PROFILE_SQL = users_upsert_sql(PROFILE_COLUMNS, ("profile_refreshed_at",))
+UPSERT_PROFILE_CAST_SQL = users_upsert_sql(PROFILE_COLUMNS + ("good_recent_cast", "liked_recent_cast"),
+                                           ("profile_refreshed_at", "cast_refreshed_at"))
+# For users whose recent casts had no reactions: the cast columns are left as they were
+UPSERT_PROFILE_NO_CAST_SQL = users_upsert_sql(PROFILE_COLUMNS, ("profile_refreshed_at", "cast_refreshed_at"))
+
+
+# (fid, *PROFILE_COLUMNS) for one user object from the Neynar user endpoints
+def profile_row(user_data):
+    return (user_data['fid'], user_data['username'], user_data['followerCount'], user_data['followingCount'],
+            user_data['viewerContext']['following'], user_data['viewerContext']['followedBy'],
+            user_data['activeStatus'])
+
+
+# Targeting queries used by the scripts, kept here so check_query_plans() tests the real SQL.
+# The activity joins use CROSS JOIN so SQLite always starts from the (small) recent-activity window.
+ACTIVE_USERS_SQL = '''
+SELECT users.fid, recent_cast_hash, following, followed_by, opt_out
+FROM activity CROSS JOIN users ON users.fid = activity.fid
+WHERE activity.last_seen_at >= ?
+'''
+RECENT_FOLLOW_CANDIDATES_SQL = '''
+SELECT users.fid FROM activity CROSS JOIN users ON users.fid = activity.fid
+WHERE activity.last_seen_at >= ? AND users.fid > ? AND following = 0
+'''
+# Casts already liked are filtered out through the actions ledger, which is keyed by cast hash
+LIKE_CANDIDATES_SQL = '''
+SELECT fid, recent_cast_hash FROM users
+WHERE recent_cast_hash IS NOT NULL AND following = 1 AND followed_by = 0
+'''
+UNFOLLOW_CANDIDATES_SQL = '''
+SELECT fid FROM users
+WHERE fid > ? AND following = 1 AND followed_by = 0 AND activeStatus != 'active'
+'''
+FOLLOW_CANDIDATES_SQL = '''
+SELECT fid FROM users
+WHERE fid > ? AND follower_count > 15 AND following_count > 55 AND following = 0
+'''
+OPT_OUT_SQL = 'SELECT fid FROM users WHERE opt_out = 1'
+# Mark likers of the opt-out cast, adding users we haven't scanned yet
+UPSERT_OPT_OUT_SQL = '''
+INSERT INTO users (fid, opt_out) VALUES (?, ?)
+ON CONFLICT(fid) DO UPDATE SET opt_out = excluded.opt_out
+'''
+PENDING_LIKES_SQL = '''
+SELECT fid, good_recent_cast FROM users
+WHERE good_recent_cast IS NOT NULL AND liked_recent_cast = 0
+'''
+# Users each follow flag is set for, diffed against our own lists by followsync.py
+FOLLOW_FLAG_SQL = {
+    "following": 'SELECT fid FROM users WHERE following = 1',
+    "followed_by": 'SELECT fid FROM users WHERE followed_by = 1',
+}
+# Highest-priority users discovery.py hasn't expanded yet
+DISCOVERY_FRONTIER_SQL = '''
+SELECT fid, depth FROM discovery
+WHERE status = 'pending'
+ORDER BY priority DESC LIMIT ?
+'''
+
+# Actions changed at or after a timestamp, for actions.Ledger.refresh
+ACTIONS_SINCE_SQL = 'SELECT fid, action, target, status, attempts, updated_at FROM actions WHERE updated_at >= ?'
+
+TARGETING_QUERIES = {
+    "activity.recently_active_users": (ACTIVE_USERS_SQL, (0,)),
+    "cronfollow.like_recent_casts": (LIKE_CANDIDATES_SQL, ()),
+    "cronfollow.opt_outs": (OPT_OUT_SQL, ()),
+    "followrecent.main": (RECENT_FOLLOW_CANDIDATES_SQL, (0, 1)),
+    "followerscript.main": (FOLLOW_CANDIDATES_SQL, (1,)),
+    "unfollow.main": (UNFOLLOW_CANDIDATES_SQL, (1,)),
+    "react.like_latest_casts": (PENDING_LIKES_SQL, ()),
+    "likequeue.claim": (likequeue.PENDING_SQL, (1,)),
+    "actions.refresh": (ACTIONS_SINCE_SQL, (0,)),
+    "discovery.frontier": (DISCOVERY_FRONTIER_SQL, (1,)),
+    "followsync.following": (FOLLOW_FLAG_SQL["following"], ()),
+    "followsync.followed_by": (FOLLOW_FLAG_SQL["followed_by"], ()),
+}
+
+
+# Create or upgrade every table and index the scripts rely on. Safe to run on every start.
+def migrate(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS users (fid INTEGER PRIMARY KEY)')
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    for name, definition in USERS_COLUMNS:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE users ADD COLUMN {name} {definition}')
+    # idx_users_followed_by used to cover every row, and won the unfollow plan
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'idx_users_followed_by'").fetchone()
+    if row and 'WHERE' not in row[0]:
+        conn.execute('DROP INDEX idx_users_followed_by')
+    for sql in USERS_INDEXES:
+        conn.execute(sql)
+    ensure_poll_state(conn)
+    ensure_activity(conn)
+    ensure_scan_shards(conn)
+    ensure_like_queue(conn)
+    ensure_actions(conn)
+    ensure_discovery(conn)
+    conn.commit()
+
+
+# Fail if any targeting query would fall back to a full scan instead of an index search
+def check_query_plans(conn):
+    problems = []
+    for name, (sql, params) in TARGETING_QUERIES.items():
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        scans = [step for step in plan if step.startswith('SCAN')]
+        if scans:
+            problems.append(f"{name}: {'; '.join(scans)}")
+        else:
+            log.info("%s: %s", name, "; ".join(plan))
+    assert not problems, "Targeting queries scan a table:\n" + "\n".join(problems)
+
+
+if __name__ == "__main__":
+    # python db.py: migrate farcaster_users.db and verify the targeting query plans
+    metrics.setup_logging()
+    conn = connect()
+    migrate(conn)
+    check_query_plans(conn)
+    conn.close()
+    print("Schema migrated; all targeting queries use indexes.")
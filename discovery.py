@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+
+import crawler
+import db
+import metrics
+import neynar
+
+log = logging.getLogger(__name__)
+
+# Finds candidate FIDs by walking the social graph outward from seed FIDs (ours, DISCOVERY_SEEDS
+# and recently active users) instead of probing every integer in a range. The discovery table
+# holds the frontier and the visited set: each run expands the highest-priority pending users
+# through their following and followers lists and the reactors of their recent casts.
+# A FID seen from several users gains priority, and priority decays with depth.
+
+# Users expanded per run, how far from the seeds to go, and list pages read per user
+MAX_NODES = int(os.getenv("DISCOVERY_NODES", 200))
+MAX_DEPTH = int(os.getenv("DISCOVERY_MAX_DEPTH", 3))
+LIST_PAGES = int(os.getenv("DISCOVERY_LIST_PAGES", 2))
+
+# Visited users are expanded again after this many hours, so coverage follows the graph as it changes
+REVISIT_HOURS = float(os.getenv("DISCOVERY_REVISIT_HOURS", 168))
+
+# Extra seed FIDs, comma separated
+SEEDS = [int(fid) for fid in os.getenv("DISCOVERY_SEEDS", "").split(",") if fid.strip()]
+
+# Recent casts whose reactors are followed up per user
+RECENT_CASTS = 5
+
+SEED_PRIORITY = 1000.0
+# Reactors are active accounts and follows are picked by a person; followers are the noisiest edge
+EDGE_WEIGHTS = {"reaction": 2.0, "following": 1.0, "follower": 0.5}
+
+# A new FID joins the frontier; one seen again gains priority and keeps its shallowest depth
+ADD_SQL = '''
+INSERT INTO discovery (fid, priority, depth, discovered_at) VALUES (?, ?, ?, ?)
+ON CONFLICT(fid) DO UPDATE SET priority = priority + excluded.priority, depth = min(depth, excluded.depth)
+'''
+VISITED_SQL = "UPDATE discovery SET status = 'visited', visited_at = ? WHERE fid = ?"
+REVISIT_SQL = "UPDATE discovery SET status = 'pending' WHERE status = 'visited' AND visited_at < ?"
+
+# Fields a list entry needs before it can be stored as a profile
+PROFILE_FIELDS = ('username', 'followerCount', 'followingCount', 'activeStatus', 'viewerContext')
+
+
+# Our own FID, DISCOVERY_SEEDS and everyone active within the activity window
+def seed_fids(conn, viewer_fid):
+    seeds = {int(viewer_fid)} | set(SEEDS)
+    seeds.update(row[0] for row in conn.execute(db.ACTIVE_USERS_SQL, (db.active_since(),)))
+    return sorted(seeds)
+
+
+# Fetch one user's neighbours (runs in a crawler worker thread, no DB access here).
+# Returns the user objects from their lists and (neighbour fid, edge kind) pairs.
+def expand(fid, client, viewer_fid):
+    users, edges = [], []
+    for kind, path in (("following", neynar.FOLLOWING_PATH), ("follower", neynar.FOLLOWERS_PATH)):
+        for user in client.iter_user_list(path, fid, viewer_fid, LIST_PAGES):
+            users.append(user)
+            edges.append((user['fid'], kind))
+    data = client.get_json("/v1/farcaster/casts", params={"fid": fid, "limit": RECENT_CASTS})
+    for cast in data.get('result', {}).get('casts', []):
+        edges.extend((reactor, "reaction") for reactor in cast.get('reactions', {}).get('fids', []))
+    return users, edges
+
+
+# Store the profiles that came with the lists and push the neighbours onto the frontier
+def store_expansion(node, result, writer, seen):
+    fid, depth = node
+    users, edges = result
+    now = int(time.time())
+    writer.add_many(db.UPSERT_PROFILE_SQL, [db.profile_row(user) + (now,) for user in users
+                                            if all(field in user for field in PROFILE_FIELDS)])
+    seen.update(neighbour for neighbour, _ in edges)
+    if depth < MAX_DEPTH:
+        weights = {}
+        for neighbour, kind in edges:
+            weights[neighbour] = weights.get(neighbour, 0) + EDGE_WEIGHTS[kind]
+        writer.add_many(ADD_SQL, [(neighbour, weight / (depth + 1), depth + 1, now)
+                                  for neighbour, weight in weights.items()])
+
+
+# Expand up to `max_nodes` users, best first, in rounds of a few per worker. Returns every FID
+# found this run; profiles that came with the follow lists are already stored.
+def discover(conn, client, seeds, viewer_fid, max_nodes=MAX_NODES, concurrency=crawler.DEFAULT_CONCURRENCY):
+    now = int(time.time())
+    with conn:
+        conn.execute(REVISIT_SQL, (now - int(REVISIT_HOURS * 3600),))
+        conn.executemany(ADD_SQL, [(fid, SEED_PRIORITY, 0, now) for fid in seeds])
+
+    writer = db.WriteBuffer(conn, batch_size=db.BULK_WRITE_BATCH_SIZE)
+    seen = set()
+    expanded = 0
+    while expanded < max_nodes:
+        nodes = conn.execute(db.DISCOVERY_FRONTIER_SQL, (min(concurrency * 4, max_nodes - expanded),)).fetchall()
+        if not nodes:
+            break
+        crawler.crawl(nodes, lambda node: expand(node[0], client, viewer_fid),
+                      lambda node, result: store_expansion(node, result, writer, seen), concurrency=concurrency)
+        # Failed expansions are marked visited too, and retried once REVISIT_HOURS have passed
+        writer.add_many(VISITED_SQL, [(int(time.time()), fid) for fid, _ in nodes])
+        writer.flush()  # the next round reads the frontier from the table
+        expanded += len(nodes)
+
+    metrics.inc("discovery_expanded_total", expanded)
+    metrics.inc("discovery_fids_total", len(seen))
+    log.info("Discovered %d FIDs from %d expanded users.", len(seen), expanded)
+    return sorted(seen)
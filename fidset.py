@@ -0,0 +1,27 @@
+# Compact set of FIDs: one bit per FID in a bytearray, so a million FIDs take 125 KB
+# and membership is a single index + mask. Safe to read from many threads once built.
+class FidBitmap:
+    def __init__(self, fids=()):
+        self.bits = bytearray()
+        self.update(fids)
+
+    def add(self, fid):
+        index = fid >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (fid & 7)
+
+    def update(self, fids):
+        for fid in fids:
+            self.add(fid)
+
+    def __contains__(self, fid):
+        index = fid >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (fid & 7)))
+
+    def __len__(self):
+        return int.from_bytes(self.bits, "little").bit_count()
+
+    # The FIDs in `fids` that are not in the set
+    def exclude(self, fids):
+        return [fid for fid in fids if fid not in self]
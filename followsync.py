@@ -0,0 +1,79 @@
+from dotenv import load_dotenv
+import logging
+import os
+import db
+import metrics
+import neynar
+
+# Load environment variables from .env file
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Get the API Key and our FID from the environment variables
+api_key = os.getenv("NEYNAR_API_KEY")
+viewer_fid = os.getenv("FARCASTER_DEVELOPER_FID")
+
+# Shared pooled connection used for every Neynar call
+client = neynar.NeynarClient(api_key)
+
+# Set one follow flag, adding users we haven't scanned yet
+FLAG_SQL = {
+    column: f'INSERT INTO users (fid, {column}) VALUES (?, ?) ON CONFLICT(fid) DO UPDATE SET {column} = excluded.{column}'
+    for column in ("following", "followed_by")
+}
+
+
+# Our FID as an int, or None when FARCASTER_DEVELOPER_FID is missing or not a number
+def parse_fid(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Every FID in one of our lists (a few dozen requests even for large accounts)
+def fetch_own_list(client, path, viewer_fid):
+    return {user['fid'] for user in client.iter_user_list(path, viewer_fid, viewer_fid, neynar.MAX_OWN_LIST_PAGES)}
+
+
+# Reconcile users.following and users.followed_by with the lists Neynar has for us, by set
+# differences against the flags already stored. Both lists are read in full before anything is
+# written, so a failed request changes nothing. Returns the FIDs whose flags changed.
+def sync_follow_state(conn, client, viewer_fid):
+    actual = {
+        "following": fetch_own_list(client, neynar.FOLLOWING_PATH, viewer_fid),
+        "followed_by": fetch_own_list(client, neynar.FOLLOWERS_PATH, viewer_fid),
+    }
+    changed = set()
+    with metrics.timed("db_flush_seconds"):
+        with conn:  # both flags in one transaction
+            for column, fids in actual.items():
+                stored = {row[0] for row in conn.execute(db.FOLLOW_FLAG_SQL[column])}
+                rows = [(fid, 1) for fid in fids - stored] + [(fid, 0) for fid in stored - fids]
+                conn.executemany(FLAG_SQL[column], rows)
+                changed.update(fid for fid, _ in rows)
+                metrics.inc("db_rows_written_total", len(rows))
+                log.info("%s: %d set, %d cleared (%d in our list).", column, len(fids - stored), len(stored - fids), len(fids))
+
+    # Cached profiles carry the old viewerContext
+    client.invalidate_users(sorted(changed))
+    return changed
+
+def main():
+    metrics.start()
+    fid = parse_fid(viewer_fid)
+    if fid is None:
+        raise SystemExit("Set FARCASTER_DEVELOPER_FID to our FID.")
+
+    # Initialize Database Connection
+    conn = db.connect()
+    db.migrate(conn)
+
+    sync_follow_state(conn, client, fid)
+
+    # Close Database Connection
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import time
+
+# Durable queue of casts to like (the like_queue table, see db.ensure_like_queue).
+# Producers enqueue (fid, cast_hash) as they discover casts; the react.py worker claims
+# pending rows, likes them and acks (done) or fails them (back to pending until MAX_ATTEMPTS).
+
+# Rows claimed per round and how long a claim may stay unacked before it's handed out again
+CLAIM_BATCH = 50
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+
+ENQUEUE_SQL = 'INSERT OR IGNORE INTO like_queue (fid, cast_hash, enqueued_at) VALUES (?, ?, ?)'
+PENDING_SQL = '''
+SELECT fid, cast_hash FROM like_queue
+WHERE status = 'pending'
+ORDER BY enqueued_at LIMIT ?
+'''
+
+
+# Queue a like for fid's cast; a cast that was ever queued before is ignored
+def enqueue(writer, fid, cast_hash):
+    writer.add(ENQUEUE_SQL, (fid, cast_hash, int(time.time())))
+
+
+# Queue every cast the users table still marks as not liked, for work found before the queue existed
+def backfill(conn, pending_sql):
+    now = int(time.time())
+    with conn:
+        conn.executemany(ENQUEUE_SQL, [(fid, cast_hash, now) for fid, cast_hash in conn.execute(pending_sql)])
+
+
+# Claim up to `limit` pending likes, oldest first. Claims older than `lease_seconds` (a worker
+# died mid-batch) go back to pending first. BEGIN IMMEDIATE keeps two workers from claiming the same row.
+def claim(conn, limit=CLAIM_BATCH, lease_seconds=LEASE_SECONDS):
+    now = int(time.time())
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("UPDATE like_queue SET status = 'pending' WHERE status = 'claimed' AND claimed_at < ?",
+                     (now - lease_seconds,))
+        rows = conn.execute(PENDING_SQL, (limit,)).fetchall()
+        conn.executemany('''
+        UPDATE like_queue SET status = 'claimed', claimed_at = ?, attempts = attempts + 1
+        WHERE fid = ? AND cast_hash = ?
+        ''', [(now, fid, cast_hash) for fid, cast_hash in rows])
+    return rows
+
+
+# The like went through: close the queue row and mark the user in the same transaction
+def ack(writer, fid, cast_hash):
+    writer.add("UPDATE like_queue SET status = 'done', acked_at = ? WHERE fid = ? AND cast_hash = ?",
+               (int(time.time()), fid, cast_hash))
+    writer.add('UPDATE users SET liked_recent_cast = 1 WHERE fid = ? AND good_recent_cast = ?', (fid, cast_hash))
+
+
+# The like failed: retry later, or give up after MAX_ATTEMPTS
+def fail(writer, fid, cast_hash, max_attempts=MAX_ATTEMPTS):
+    writer.add('''
+    UPDATE like_queue SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+    WHERE fid = ? AND cast_hash = ?
+    ''', (max_attempts, fid, cast_hash))
+
+
+# Block until another connection commits to the database (PRAGMA data_version changes),
+# checking every `interval` seconds. Returns the new version.
+def wait_for_change(conn, version, interval=0.25):
+    while True:
+        current = conn.execute('PRAGMA data_version').fetchone()[0]
+        if current != version:
+            return current
+        time.sleep(interval)
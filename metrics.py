@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process counters and latency histograms for API calls, retries, DB writes and task stages.
+# Exposed in the Prometheus text format on METRICS_PORT and/or dumped as JSON to METRICS_JSON
+# every METRICS_INTERVAL seconds. Logging is configured from LOG_LEVEL (default INFO);
+# per-item messages are logged at DEBUG so busy loops don't pay for console output.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_JSON = os.getenv("METRICS_JSON")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 60))
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "neynar_requests_total": "Neynar API requests by endpoint and final status code",
+    "neynar_request_seconds": "Neynar API request latency, retries included",
+    "neynar_retries_total": "Requests retried after a 429/5xx status or a connection error",
+    "neynar_cache_total": "Response cache lookups by endpoint and outcome",
+    "db_rows_written_total": "Rows written through db.WriteBuffer",
+    "db_flushes_total": "db.WriteBuffer transactions committed",
+    "db_flush_seconds": "Time spent committing one db.WriteBuffer flush",
+    "stage_seconds": "Duration of a task stage",
+    "pipeline_items_total": "Items handled by each pipeline stage",
+    "discovery_expanded_total": "Users whose lists were walked by discovery",
+    "discovery_fids_total": "FIDs found by discovery (counted once per run)",
+    "webhook_events_total": "Webhook deliveries by event type and outcome",
+}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: [bucket counts..., +Inf count, sum]}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = _key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            counts = series.setdefault(_key(labels), [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    # Sum of a counter across every label set matching `labels`
+    def value(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for key, value in self.counters.get(name, {}).items() if wanted <= set(key))
+
+    # Sum of a histogram's observations across every label set matching `labels`
+    def total(self, name, **labels):
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(counts[-1] for key, counts in self.histograms.get(name, {}).items() if wanted <= set(key))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, counts in sorted(series.items()):
+                    for bound, count in zip(BUCKETS, counts):
+                        lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {counts[-2]}")
+                    lines.append(f"{name}_count{_labels(key)} {counts[-2]}")
+                    lines.append(f"{name}_sum{_labels(key)} {counts[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "histograms": {name: [{"labels": dict(key), "count": counts[-2], "sum": counts[-1],
+                                       "buckets": dict(zip(map(str, BUCKETS), counts))}
+                                      for key, counts in series.items()]
+                               for name, series in self.histograms.items()},
+            }
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+# Shared registry for everything in this process
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+
+
+# Time a block of work: `with metrics.timed("stage_seconds", stage="likes"):`
+@contextmanager
+def timed(name, **labels):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics for Prometheus from a background thread
+def serve(port=METRICS_PORT):
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def dump_json(path=METRICS_JSON):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.to_json(), f)
+    os.replace(tmp, path)
+
+
+# Write the JSON dump every `interval` seconds from a background thread
+def start_dump(path=METRICS_JSON, interval=METRICS_INTERVAL):
+    def run():
+        while True:
+            time.sleep(interval)
+            dump_json(path)
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+
+
+def setup_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+# Entry point for the scripts: configure logging and start whichever exporters are configured
+def start():
+    setup_logging()
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+    if METRICS_JSON:
+        start_dump(METRICS_JSON)
@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Local stand-in for the Neynar endpoints the scripts call, for offline benchmarking.
+# Data is synthetic but deterministic per FID, so repeated runs see the same network.
+#   python mock_neynar.py --port 8787 --latency 0.05 --rate 50 --error-rate 0.01
+#   NEYNAR_API_URL=http://127.0.0.1:8787 python app.py
+
+DEFAULT_PORT = 8787
+DEFAULT_USERS = 200000
+RECENT_CAST_COUNT = 2000
+RECENT_CAST_REACTORS = 5
+CAST_LIKE_COUNT = 250
+
+
+def cast_hash(fid, index=0):
+    return "0x" + hashlib.sha1(f"{fid}:{index}".encode()).hexdigest()
+
+
+# Deterministic v2 user object; FIDs above --users don't exist
+def make_user(fid):
+    rng = random.Random(fid)
+    return {
+        "fid": fid,
+        "username": f"user{fid}",
+        "follower_count": rng.randint(0, 5000),
+        "following_count": rng.randint(0, 2000),
+        "active_status": rng.choice(["active", "inactive"]),
+        "viewer_context": {"following": rng.random() < 0.1, "followed_by": rng.random() < 0.05},
+    }
+
+
+# Newest-first feed of recent casts, each with a few reactor FIDs
+def make_recent_casts(users, count=RECENT_CAST_COUNT):
+    now = datetime.now(timezone.utc)
+    casts = []
+    for i in range(count):
+        rng = random.Random(i)
+        author = rng.randint(1, users)
+        timestamp = (now - timedelta(seconds=i * 5)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        fids = [rng.randint(1, users) for _ in range(RECENT_CAST_REACTORS)]
+        casts.append({
+            "hash": cast_hash(author, i),
+            "timestamp": timestamp,
+            "author": {"fid": author},
+            "reactions": {"count": len(fids), "fids": fids},
+        })
+    return casts
+
+
+# Fixed window request counter per second; returns seconds to wait when over the limit
+class RateLimit:
+    def __init__(self, rate):
+        self.rate = rate
+        self.window = int(time.time())
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = int(time.time())
+            if now != self.window:
+                self.window, self.count = now, 0
+            self.count += 1
+            if self.count > self.rate:
+                return 1
+        return 0
+
+
+class MockNeynar(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        wait = server.limit.check()
+        if wait or random.random() < server.error_rate:
+            self.respond(429, {"message": "Too Many Requests"}, {"Retry-After": str(wait or 1)})
+            return
+
+        route = server.routes.get((method, url.path))
+        if route is None:
+            self.respond(404, {"message": f"No mock for {method} {url.path}"})
+            return
+        payload = route(server, params, body)
+        if method != "GET":
+            self.respond(200, payload)
+            return
+        # ETags on GETs, so conditional requests can be answered with 304 Not Modified
+        data = json.dumps(payload).encode()
+        etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.respond(200, payload, {"ETag": etag}, data)
+
+    def respond(self, status, payload, headers=None, data=None):
+        data = data or json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def recent_casts(server, params, body):
+    start = int(params.get("cursor") or 0)
+    limit = int(params.get("limit") or 25)
+    page = server.recent_casts[start:start + limit]
+    cursor = str(start + limit) if start + limit < len(server.recent_casts) else None
+    return {"result": {"casts": page, "next": {"cursor": cursor}}}
+
+
+def casts(server, params, body):
+    fid = int(params["fid"])
+    limit = int(params.get("limit") or 25)
+    rng = random.Random(fid)
+    result = []
+    for i in range(limit):
+        fids = [rng.randint(1, server.users) for _ in range(rng.randint(0, 3))]
+        result.append({"hash": cast_hash(fid, -1 - i), "author": {"fid": fid},
+                       "reactions": {"count": len(fids), "fids": fids}})
+    return {"result": {"casts": result}}
+
+
+# The same user in the v1 shape
+def make_v1_user(fid):
+    v2 = make_user(fid)
+    return {
+        "fid": fid,
+        "username": v2["username"],
+        "followerCount": v2["follower_count"],
+        "followingCount": v2["following_count"],
+        "activeStatus": v2["active_status"],
+        "viewerContext": {"following": v2["viewer_context"]["following"],
+                          "followedBy": v2["viewer_context"]["followed_by"]},
+    }
+
+
+def user(server, params, body):
+    return {"result": {"user": make_v1_user(int(params["fid"]))}}
+
+
+def user_bulk(server, params, body):
+    fids = [int(fid) for fid in params.get("fids", "").split(",") if fid]
+    return {"users": [make_user(fid) for fid in fids if fid <= server.users]}
+
+
+# Newest-first likes of a cast, paged with a cursor like recent-casts
+def cast_likes(server, params, body):
+    rng = random.Random(params.get("castHash"))
+    now = datetime.now(timezone.utc)
+    likes = [{"reactor": {"fid": rng.randint(1, server.users)},
+              "timestamp": (now - timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:00.000Z")}
+             for i in range(CAST_LIKE_COUNT)]
+    start = int(params.get("cursor") or 0)
+    limit = int(params.get("limit") or 25)
+    cursor = str(start + limit) if start + limit < len(likes) else None
+    return {"result": {"likes": likes[start:start + limit], "next": {"cursor": cursor}}}
+
+
+# A user's followers or following: as many deterministic FIDs as their profile's count, paged with a cursor
+def user_list(kind):
+    def handler(server, params, body):
+        fid = int(params["fid"])
+        count = make_user(fid)[f"{kind}_count"]
+        rng = random.Random(f"{kind}:{fid}")
+        fids = [rng.randint(1, server.users) for _ in range(count)]
+        start = int(params.get("cursor") or 0)
+        limit = int(params.get("limit") or 25)
+        cursor = str(start + limit) if start + limit < len(fids) else None
+        return {"result": {"users": [make_v1_user(fid) for fid in fids[start:start + limit]],
+                           "next": {"cursor": cursor}}}
+    return handler
+
+
+def follow(server, params, body):
+    return {"success": True,
+            "details": [{"success": True, "target_fid": fid} for fid in body.get("target_fids", [])]}
+
+
+def reaction(server, params, body):
+    return {"success": True}
+
+
+ROUTES = {
+    ("GET", "/v1/farcaster/recent-casts"): recent_casts,
+    ("GET", "/v1/farcaster/casts"): casts,
+    ("GET", "/v1/farcaster/user"): user,
+    ("GET", "/v2/farcaster/user/bulk"): user_bulk,
+    ("GET", "/v1/farcaster/cast-likes"): cast_likes,
+    ("GET", "/v1/farcaster/followers"): user_list("follower"),
+    ("GET", "/v1/farcaster/following"): user_list("following"),
+    ("POST", "/v2/farcaster/user/follow"): follow,
+    ("DELETE", "/v2/farcaster/user/follow"): follow,
+    ("POST", "/v2/farcaster/reaction"): reaction,
+}
+
+
+def make_server(port=DEFAULT_PORT, latency=0.0, jitter=0.0, rate=0, error_rate=0.0, users=DEFAULT_USERS,
+                verbose=False):
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockNeynar)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.limit = RateLimit(rate)
+    server.error_rate = error_rate
+    server.users = users
+    server.verbose = verbose
+    server.routes = ROUTES
+    server.recent_casts = make_recent_casts(users)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Neynar API")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument("--rate", type=int, default=0, help="requests per second before answering 429 (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="highest FID that exists")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, args.jitter, args.rate, args.error_rate, args.users, args.verbose)
+    print(f"Mock Neynar listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
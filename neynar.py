@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+import cache
+import metrics
+import ratelimit
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Base URL for every call (point NEYNAR_API_URL at a local stand-in to test offline)
+API_URL = os.getenv("NEYNAR_API_URL", "https://api.neynar.com").rstrip("/")
+
+# Connection, timeout and retry defaults for the shared client
+POOL_SIZE = 16
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+# Latency samples kept per endpoint for percentiles
+LATENCY_SAMPLES = 10000
+
+# Neynar's bulk user endpoint accepts up to 100 FIDs per request
+BULK_USER_PATH = "/v2/farcaster/user/bulk"
+BULK_USER_LIMIT = 100
+
+# The follow endpoint accepts a list of target FIDs; keep each request to a manageable size
+FOLLOW_PATH = "/v2/farcaster/user/follow"
+FOLLOW_BATCH_LIMIT = 100
+
+# recent-casts is paged newest first; the first run without a high-water mark only reads one page
+RECENT_CASTS_PATH = "/v1/farcaster/recent-casts"
+RECENT_CASTS_LIMIT = 100
+MAX_RECENT_CAST_PAGES = 50
+
+# cast-likes is paged newest first as well; an opt-out cast's likers are read in full
+CAST_LIKES_PATH = "/v1/farcaster/cast-likes"
+CAST_LIKES_LIMIT = 100
+MAX_CAST_LIKE_PAGES = 1000
+
+# A user's followers and following lists, paged with a cursor; each entry is a v1 user object
+FOLLOWERS_PATH = "/v1/farcaster/followers"
+FOLLOWING_PATH = "/v1/farcaster/following"
+USER_LIST_LIMIT = 150
+# Our own lists are read in full
+MAX_OWN_LIST_PAGES = 10000
+
+
+# Session with a keep-alive pool big enough for every concurrent worker
+def make_session(pool_size=POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Cache key for one user from the bulk endpoint, as seen by viewer_fid
+def user_cache_key(fid, viewer_fid=None):
+    return f"{BULK_USER_PATH}/{fid}?viewer_fid={viewer_fid or ''}"
+
+
+# Split a sequence of FIDs into lists of at most `size`
+def chunked(fids, size=BULK_USER_LIMIT):
+    batch = []
+    for fid in fids:
+        batch.append(fid)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Convert a v2 user object into the v1 shape db.profile_row expects
+def to_v1_user(user):
+    viewer_context = user.get('viewer_context') or {}
+    return {
+        'fid': user['fid'],
+        'username': user.get('username'),
+        'followerCount': user.get('follower_count'),
+        'followingCount': user.get('following_count'),
+        'activeStatus': user.get('active_status'),
+        'viewerContext': {
+            'following': viewer_context.get('following', False),
+            'followedBy': viewer_context.get('followed_by', False),
+        },
+    }
+
+
+# One pooled, rate-limited connection to Neynar shared by everything in a script.
+# Keeps per-endpoint request counts and latencies so slow calls are easy to spot.
+# GETs made through get_json() and fetch_users_bulk() go through the response cache.
+class NeynarClient:
+    def __init__(self, api_key, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 max_retries=ratelimit.MAX_RETRIES, limiter=ratelimit.limiter, base_url=API_URL,
+                 cache=cache.response_cache):
+        self.base_url = base_url
+        self.cache = cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = limiter
+        self.session = make_session(pool_size)
+        self.session.headers.update({
+            "accept": "application/json",
+            "api_key": api_key or "",
+        })
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def request(self, method, path, **kwargs):
+        url = path if path.startswith("http") else self.base_url + path
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = f"{method} {urlsplit(url).path}"
+        started = time.monotonic()
+        status = "error"
+        try:
+            response = ratelimit.send(method, url, session=self.session, limiter=self.limiter,
+                                      max_retries=self.max_retries, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            elapsed = time.monotonic() - started
+            self._record(endpoint, elapsed)
+            metrics.inc("neynar_requests_total", endpoint=endpoint, status=status)
+            metrics.observe("neynar_request_seconds", elapsed, endpoint=endpoint)
+
+    def get(self, path, params=None, **kwargs):
+        return self.request("GET", path, params=params, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request("POST", path, json=json, **kwargs)
+
+    def delete(self, path, json=None, **kwargs):
+        return self.request("DELETE", path, json=json, **kwargs)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {}  # "GET /v2/..." -> [count, total_seconds, max_seconds]
+            self.samples = {}  # "GET /v2/..." -> recent latencies in seconds
+            self.cache_stats = {}  # "/v1/..." -> [fresh hits, revalidated (304), misses]
+
+    def _record(self, endpoint, elapsed):
+        with self.stats_lock:
+            entry = self.stats.setdefault(endpoint, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+            self.samples.setdefault(endpoint, deque(maxlen=LATENCY_SAMPLES)).append(elapsed)
+
+    def _record_cache(self, path, outcome, count=1):
+        with self.stats_lock:
+            self.cache_stats.setdefault(path, [0, 0, 0])[outcome] += count
+        if count:
+            metrics.inc("neynar_cache_total", count, endpoint=path, outcome=("hit", "revalidated", "miss")[outcome])
+
+    # Latency percentile in seconds for one endpoint, or across all endpoints
+    def latency_percentile(self, percentile, endpoint=None):
+        with self.stats_lock:
+            if endpoint is None:
+                samples = sorted(sample for values in self.samples.values() for sample in values)
+            else:
+                samples = sorted(self.samples.get(endpoint, ()))
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def log_stats(self):
+        with self.stats_lock:
+            stats = sorted(self.stats.items())
+        for endpoint, (count, total, slowest) in stats:
+            log.info("%s: %d requests, avg %.0fms, max %.0fms", endpoint, count, total / count * 1000, slowest * 1000)
+        with self.stats_lock:
+            cache_stats = sorted(self.cache_stats.items())
+        for path, (hits, revalidated, misses) in cache_stats:
+            log.info("cache %s: %d hits, %d revalidated, %d misses", path, hits, revalidated, misses)
+
+    # GET and decode JSON, serving fresh cached responses without a request and revalidating
+    # stale ones with If-None-Match when the server sent an ETag
+    def get_json(self, path, params=None):
+        if self.cache is None or not self.cache.cacheable(path):
+            response = self.get(path, params=params)
+            response.raise_for_status()
+            return response.json()
+
+        key = cache.cache_key(path, params)
+        cached = self.cache.get(path, key)
+        if cached and cached[2]:
+            self._record_cache(path, 0)
+            return json.loads(cached[0])
+
+        headers = {"If-None-Match": cached[1]} if cached and cached[1] else None
+        response = self.get(path, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            self.cache.touch(key)
+            self._record_cache(path, 1)
+            return json.loads(cached[0])
+        response.raise_for_status()
+        self.cache.put(path, key, response.text, response.headers.get("ETag"))
+        self._record_cache(path, 2)
+        return response.json()
+
+    # Fetch up to BULK_USER_LIMIT users in one request; FIDs that don't exist are simply absent.
+    # Users are cached one per FID, so only the FIDs without a fresh entry are requested.
+    def fetch_users_bulk(self, fids, viewer_fid=None):
+        users = []
+        if self.cache is not None and self.cache.cacheable(BULK_USER_PATH):
+            missing = []
+            for fid in fids:
+                cached = self.cache.get(BULK_USER_PATH, user_cache_key(fid, viewer_fid))
+                if cached and cached[2]:
+                    users.append(json.loads(cached[0]))
+                else:
+                    missing.append(fid)
+            self._record_cache(BULK_USER_PATH, 0, len(users))
+        else:
+            missing = list(fids)
+
+        if missing:
+            params = {"fids": ",".join(str(fid) for fid in missing)}
+            if viewer_fid:
+                params["viewer_fid"] = viewer_fid
+            response = self.get(BULK_USER_PATH, params=params)
+            response.raise_for_status()
+            fetched = response.json().get('users', [])
+            if self.cache is not None and self.cache.cacheable(BULK_USER_PATH):
+                self.cache.put_many(BULK_USER_PATH, [(user_cache_key(user['fid'], viewer_fid), json.dumps(user), None)
+                                                     for user in fetched])
+                self._record_cache(BULK_USER_PATH, 2, len(missing))
+            users.extend(fetched)
+        return [to_v1_user(user) for user in users]
+
+    # Follow (method="POST") or unfollow (method="DELETE") a batch of FIDs in one request.
+    # Returns (succeeded, failed) lists of FIDs using the per-target details in the response.
+    def follow_users_bulk(self, fids, signer_uuid, method="POST"):
+        payload = {
+            "signer_uuid": signer_uuid,
+            "target_fids": list(fids)
+        }
+        response = self.request(method, FOLLOW_PATH, json=payload)
+        response.raise_for_status()
+        data = response.json() if response.content else {}
+
+        details = data.get('details')
+        if not details:
+            # No per-target breakdown: the whole batch shares the top-level result
+            if data.get('success', True):
+                self.invalidate_users(fids)
+                return list(fids), []
+            return [], list(fids)
+
+        succeeded = {detail['target_fid'] for detail in details if detail.get('success')}
+        self.invalidate_users(succeeded)
+        return [fid for fid in fids if fid in succeeded], [fid for fid in fids if fid not in succeeded]
+
+    # Our follow state for these users just changed, so their cached profiles are out of date
+    def invalidate_users(self, fids):
+        if self.cache is not None and fids:
+            self.cache.invalidate([f"{BULK_USER_PATH}/{fid}?" for fid in fids])
+
+    # Page forward through recent casts until reaching the last cast seen by the previous run,
+    # yielding the new casts newest first as each page arrives
+    def iter_recent_casts_since(self, last_timestamp=None, last_hash=None, viewer_fid=2056,
+                                max_pages=MAX_RECENT_CAST_PAGES):
+        if last_timestamp is None and last_hash is None:
+            max_pages = 1
+        cursor = None
+        for _ in range(max_pages):
+            params = {"viewerFid": viewer_fid, "limit": RECENT_CASTS_LIMIT}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get(RECENT_CASTS_PATH, params=params)
+            response.raise_for_status()
+            result = response.json().get('result', {})
+            for cast in result.get('casts', []):
+                if cast.get('hash') == last_hash or (last_timestamp and cast.get('timestamp', '') < last_timestamp):
+                    return
+                yield cast
+            cursor = (result.get('next') or {}).get('cursor')
+            if not cursor:
+                break
+
+    # Page through a cast's likes newest first, stopping at likes no newer than `since` (a timestamp)
+    def iter_cast_likes(self, cast_hash, since=None, viewer_fid=2056, max_pages=MAX_CAST_LIKE_PAGES):
+        cursor = None
+        for _ in range(max_pages):
+            params = {"castHash": cast_hash, "viewerFid": viewer_fid, "limit": CAST_LIKES_LIMIT}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get(CAST_LIKES_PATH, params=params)
+            response.raise_for_status()
+            result = response.json().get('result', {})
+            for like in result.get('likes', []):
+                if since and like.get('timestamp') and like['timestamp'] <= since:
+                    return
+                yield like
+            cursor = (result.get('next') or {}).get('cursor')
+            if not cursor:
+                break
+
+    # Page through the users in a followers/following list, at most `max_pages` pages
+    def iter_user_list(self, path, fid, viewer_fid=2056, max_pages=1):
+        cursor = None
+        for _ in range(max_pages):
+            params = {"fid": fid, "viewerFid": viewer_fid, "limit": USER_LIST_LIMIT}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get(path, params=params)
+            response.raise_for_status()
+            result = response.json().get('result', {})
+            yield from result.get('users', [])
+            cursor = (result.get('next') or {}).get('cursor')
+            if not cursor:
+                break
+
+    def fetch_recent_casts_since(self, last_timestamp=None, last_hash=None, viewer_fid=2056,
+                                 max_pages=MAX_RECENT_CAST_PAGES):
+        return list(self.iter_recent_casts_since(last_timestamp, last_hash, viewer_fid, max_pages))
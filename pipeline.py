@@ -0,0 +1,142 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Bounded queues between stages: a fast stage blocks instead of piling work up in memory
+QUEUE_SIZE = 500
+
+# Marks the end of a stream; every stage forwards it once all of its workers are done
+DONE = object()
+
+
+# Stand-in for db.WriteBuffer that stage threads can use. Writes are queued and applied
+# by the thread that owns the sqlite connection (see Pipeline.run), flushes included.
+class QueuedWriter:
+    def __init__(self, writes):
+        self.writes = writes
+
+    def add(self, sql, params=()):
+        self.writes.put(("add", sql, params))
+
+    def add_many(self, sql, rows):
+        rows = list(rows)
+        if rows:
+            self.writes.put(("add_many", sql, rows))
+
+    def flush(self):
+        self.writes.put(("flush",))
+
+
+# Producer/consumer pipeline: a source thread feeds stages connected by bounded queues,
+# each stage running one or more worker threads. Stage threads never touch the database;
+# they write through `pipeline.writer` and run() applies those writes on the calling thread.
+class Pipeline:
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.threads = []
+        self.writes = queue.Queue(maxsize=queue_size)
+        self.writer = QueuedWriter(self.writes)
+        self.failed = set()  # names of the sources and stages that hit an error
+
+    def queue(self):
+        return queue.Queue(maxsize=self.queue_size)
+
+    def _start(self, name, target):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        self.threads.append(thread)
+
+    # Put every item produced by generate() onto outbox. A source that raises is listed in
+    # `failed`, so callers can tell a finished stream from one that stopped early.
+    def source(self, name, generate, outbox):
+        def run():
+            try:
+                for item in generate():
+                    outbox.put(item)
+            except Exception as e:
+                log.error("%s stopped: %s", name, e)
+                self.failed.add(name)
+            finally:
+                outbox.put(DONE)
+        self._start(name, run)
+
+    # Call handle(item) for every item on inbox and put whatever it yields onto outbox.
+    # An item that raises is logged and dropped, and the stage is listed in `failed`.
+    def stage(self, name, handle, inbox, outbox=None, workers=1):
+        remaining = [workers]
+        lock = threading.Lock()
+
+        def run():
+            while True:
+                item = inbox.get()
+                if item is DONE:
+                    inbox.put(DONE)  # let the other workers of this stage see it too
+                    break
+                try:
+                    for result in handle(item) or ():
+                        if outbox is not None:
+                            outbox.put(result)
+                    metrics.inc("pipeline_items_total", stage=name)
+                except Exception as e:
+                    metrics.inc("pipeline_items_total", stage=name, status="failed")
+                    log.warning("%s failed on %s: %s", name, item, e)
+                    self.failed.add(name)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                outbox.put(DONE)
+
+        for i in range(workers):
+            self._start(f"{name}-{i}", run)
+
+    # Group items into lists of up to `size`, sending a partial batch after `max_wait` seconds
+    # so downstream work starts right away instead of waiting for a full batch
+    def batch(self, name, inbox, outbox, size, max_wait=1.0):
+        def run():
+            items = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    item = inbox.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is DONE:
+                    break
+                if item is not None:
+                    items.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + max_wait
+                if items and (len(items) >= size or time.monotonic() >= deadline):
+                    outbox.put(items)
+                    items, deadline = [], None
+            if items:
+                outbox.put(items)
+            outbox.put(DONE)
+        self._start(name, run)
+
+    # Start every stage and apply queued writes to `writer` until all stages have finished.
+    # A long-running source (webhook.py) keeps this going until the process exits.
+    def run(self, writer):
+        for thread in self.threads:
+            thread.start()
+        while True:
+            try:
+                write = self.writes.get(timeout=0.2)
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in self.threads) and self.writes.empty():
+                    break
+                writer.flush()  # commit what's buffered while the stages are idle
+                continue
+            if write[0] == "add":
+                writer.add(write[1], write[2])
+            elif write[0] == "add_many":
+                writer.add_many(write[1], write[2])
+            else:
+                writer.flush()
+        writer.flush()
@@ -0,0 +1,170 @@
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Starting request rate (per second) and the ceiling the limiter ramps back up to.
+# Neynar counts quota per minute, e.g. 600 RPM = 10 requests/second.
+DEFAULT_RATE = float(os.getenv("NEYNAR_RATE", 10))
+MAX_RATE = float(os.getenv("NEYNAR_MAX_RATE", DEFAULT_RATE))
+MIN_RATE = 0.2
+
+# Throttled responses within this many seconds of the last halving don't halve the rate again
+THROTTLE_WINDOW = 1.0
+
+# Retry settings for throttled or failed requests
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+# Token bucket shared by every thread so all requests together stay under the API quota
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # Hold every caller for `seconds`, e.g. until the quota window resets
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+# Token bucket that halves its rate on 429/5xx and creeps back up on success (AIMD),
+# and pauses everyone when the rate-limit headers say the quota is used up.
+class AdaptiveRateLimiter(TokenBucket):
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=None):
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate or MAX_RATE, rate)
+        self.step = self.max_rate / 50  # about 50 clean responses to recover from one halving
+        self.throttled_until = 0.0
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    # A burst of 429s from requests already in flight is one signal, not several: the rate is
+    # halved at most once per throttle window (the retry delay, or THROTTLE_WINDOW if shorter)
+    def on_throttle(self, delay):
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.throttled_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.throttled_until = now + max(delay, THROTTLE_WINDOW)
+        self.pause(delay)
+
+    def observe(self, response):
+        remaining = _header_number(response, "x-ratelimit-remaining")
+        if remaining is not None and remaining <= 0:
+            reset = _reset_delay(response)
+            if reset:
+                log.info("Rate limit budget exhausted, pausing %.1fs until reset", reset)
+                self.pause(reset)
+
+
+def _header_number(response, name):
+    value = response.headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+# Seconds until the rate-limit window resets; the header may be a delay or an epoch timestamp
+def _reset_delay(response):
+    reset = _header_number(response, "x-ratelimit-reset")
+    if reset is None:
+        return None
+    if reset > 1e9:
+        reset -= time.time()
+    return max(reset, 0)
+
+
+# Seconds to wait from a Retry-After header (either seconds or an HTTP date)
+def retry_after(response):
+    value = response.headers.get("retry-after")
+    if not value:
+        return _reset_delay(response)
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Exponential backoff with full jitter
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+# Shared limiter for every script in this process
+limiter = AdaptiveRateLimiter()
+
+
+# Send a request through the limiter, retrying 429/5xx and connection errors with backoff.
+# The last response is returned as-is so callers keep their raise_for_status handling.
+def send(method, url, session=requests, limiter=limiter, max_retries=MAX_RETRIES, **kwargs):
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff(attempt)
+            metrics.inc("neynar_retries_total", reason=type(e).__name__)
+            log.info("%s %s failed (%s), retrying in %.1fs", method, url, e, delay)
+            limiter.pause(delay)
+            continue
+
+        limiter.observe(response)
+        if response.status_code not in RETRY_STATUSES:
+            limiter.on_success()
+            return response
+        if attempt == max_retries:
+            return response
+
+        delay = retry_after(response)
+        if delay is None:
+            delay = backoff(attempt)
+        metrics.inc("neynar_retries_total", reason=str(response.status_code))
+        log.info("%s %s returned %s, retrying in %.1fs", method, url, response.status_code, delay)
+        limiter.on_throttle(delay)
+    return response
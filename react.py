@@ -1,72 +1,107 @@
-import sqlite3
 import requests
-import time
 from dotenv import load_dotenv
+import logging
 import os
+import actions
+import crawler
+import db
+import likequeue
+import metrics
+import neynar
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Get the API Key from the environment variable
 api_key = os.getenv("NEYNAR_API_KEY")  # Ensure you have your API key in the .env file
 signer_uuid = os.getenv("NEYNAR_FARCASTER_UUID")
 
-def like_cast(fid, cast_hash, api_key, signer_uuid):
-    print(f"Attempting to like cast {cast_hash} for user {fid}")  # Logging
+# Shared pooled connection used for every Neynar call
+client = neynar.NeynarClient(api_key)
+
+# How many likes are sent at once
+like_concurrency = int(os.getenv("LIKE_CONCURRENCY", 8))
+
+# Like one cast; runs in a crawler worker thread, so no database access here
+def like_cast(fid, cast_hash, client, signer_uuid):
+    log.debug("Attempting to like cast %s for user %d", cast_hash, fid)
 
-    url = "https://api.neynar.com/v2/farcaster/reaction"
-    headers = {
-        "accept": "application/json",
-        "api_key": api_key,
-        "content-type": "application/json"
-    }
     payload = {
         "signer_uuid": signer_uuid,
         "target": cast_hash,
         "reaction_type": "like"
     }
 
-    print(f"Payload for like request: {payload}")  # Logging
-
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = client.post("/v2/farcaster/reaction", json=payload)
         response.raise_for_status()
-        print(f"Successfully liked cast {cast_hash} for user: {fid}")
-
-        # Open a new connection to update the database
-        with sqlite3.connect('farcaster_users.db') as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-            UPDATE users SET liked_recent_cast = 1 WHERE fid = ?
-            ''', (fid,))
-            conn.commit()
-        
+        log.debug("Successfully liked cast %s for user: %d", cast_hash, fid)
+        return True
     except requests.exceptions.HTTPError as e:
-        print(f"Error liking cast {cast_hash} for user {fid}: {e}")
-        print("Response content:", response.content.decode())
+        log.warning("Error liking cast %s for user %d: %s", cast_hash, fid, e)
+        log.debug("Response content: %s", e.response.content.decode())
+        return False
+    except requests.exceptions.RequestException as e:
+        log.warning("Error liking cast %s for user %d: %s", cast_hash, fid, e)
+        return False
+
+# Ack or fail the queue row for a like and record it in the ledger
+# (runs on the worker's main thread, which owns the connection)
+def record_like(item, liked, writer, ledger):
+    fid, cast_hash = item
+    ledger.record(writer, fid, actions.LIKE, liked, cast_hash)
+    if liked:
+        likequeue.ack(writer, fid, cast_hash)
+    else:
+        likequeue.fail(writer, fid, cast_hash)
 
-    print(f"Completed liking process for cast {cast_hash} of user {fid}")  # Logging
+# Long-running worker: keep one connection, claim pending likes from like_queue, like them
+# concurrently and ack each one. When the queue is empty it sleeps until another process
+# commits to the database, instead of re-scanning the users table. until_idle=True returns
+# as soon as the queue is drained.
+def like_latest_casts(client, signer_uuid, until_idle=False):
+    conn = db.connect()
+    writer = db.WriteBuffer(conn)
+    db.migrate(conn)
+    likequeue.backfill(conn, db.PENDING_LIKES_SQL)
+    ledger = actions.Ledger(conn)
 
-def like_latest_casts(api_key, signer_uuid):
     while True:
-        # Open a new connection for each iteration
-        with sqlite3.connect('farcaster_users.db') as conn:
-            cursor = conn.cursor()
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        batch = likequeue.claim(conn)
+        if not batch:
+            if until_idle:
+                break
+            likequeue.wait_for_change(conn, version)
+            continue
 
-            # Fetch users whose recent cast has not been liked yet
-            cursor.execute('SELECT fid, good_recent_cast FROM users WHERE good_recent_cast IS NOT NULL AND liked_recent_cast = 0')
-            users_and_casts = cursor.fetchall()
+        # Casts another script already liked (possibly while we slept) are acked without
+        # calling the API again
+        ledger.refresh(conn)
+        to_like = []
+        for fid, cast_hash in batch:
+            if ledger.done(fid, actions.LIKE, cast_hash):
+                likequeue.ack(writer, fid, cast_hash)
+            elif ledger.claim(fid, actions.LIKE, cast_hash):
+                to_like.append((fid, cast_hash))
+            else:
+                likequeue.fail(writer, fid, cast_hash)
 
-        for fid, cast_hash in users_and_casts:
-            like_cast(fid, cast_hash, api_key, signer_uuid)
-            time.sleep(1)  # Pause for 1 second between each like request
-        
-        print("Waiting 30 seconds before refreshing data...")
-        time.sleep(30)  # Wait for 30 seconds before fetching new data
+        crawler.crawl(to_like, lambda item: like_cast(item[0], item[1], client, signer_uuid),
+                      lambda item, liked: record_like(item, liked, writer, ledger), concurrency=like_concurrency)
+        # A like whose call raised was never recorded; let a later batch claim it again
+        for fid, cast_hash in to_like:
+            ledger.release_many([fid], actions.LIKE, cast_hash)
+        writer.flush()
+    conn.close()
 
 def main():
+    metrics.start()
+
     # Like the Latest Casts
-    like_latest_casts(api_key, signer_uuid)
+    like_latest_casts(client, signer_uuid)
 
 if __name__ == "__main__":
     main()
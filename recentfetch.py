@@ -1,39 +1,42 @@
-import requests
-import sqlite3
 import datetime
+import logging
+import db
+import metrics
+import neynar
 
-# Define the API URL and headers
-url = "https://api.neynar.com/v1/farcaster/recent-casts?viewerFid=2056&limit=100"
-headers = {
-    "accept": "application/json",
-    "api_key": "NEYNAR_API_DOCS"  # Replace with your actual API key
-}
+metrics.start()
+log = logging.getLogger(__name__)
 
-# Fetch the response from the API
-response = requests.get(url, headers=headers)
-data = response.json()
-
-# Extract FIDs of users who reacted to the casts
-active_fids = set()
-for cast in data['result']['casts']:
-    active_fids.update(cast['reactions']['fids'])
+# Shared pooled connection used for every Neynar call
+client = neynar.NeynarClient("NEYNAR_API_DOCS")  # Replace with your actual API key
 
 # Connect to the database
-conn = sqlite3.connect('farcaster_users.db')
-cursor = conn.cursor()
-
-# Update the recently_active column for the active FIDs
-log_entries = []
-for fid in active_fids:
-    cursor.execute("UPDATE users SET recently_active = 1 WHERE fid = ?", (fid,))
-    affected_rows = cursor.rowcount
-    if affected_rows > 0:
-        log_entry = f"Updated FID {fid} to recently active at {datetime.datetime.now()}"
-        log_entries.append(log_entry)
-        print(log_entry)
-
-# Commit the changes and close the connection
-conn.commit()
+conn = db.connect()
+db.migrate(conn)
+
+# Fetch every cast since the last run, paging forward from the stored high-water mark
+last_timestamp, last_hash = db.get_poll_state(conn, "recentfetch")
+casts = client.fetch_recent_casts_since(last_timestamp, last_hash)
+
+# Extract FIDs of users who reacted to the casts, with the newest cast each reacted to
+active_fids = {}
+for cast in casts:
+    for fid in cast['reactions']['fids']:
+        active_fids.setdefault(fid, cast.get('hash'))
+
+# Upsert the active FIDs into the activity table in one transaction
+writer = db.WriteBuffer(conn)
+db.record_activity(writer, active_fids)
+writer.flush()
+
+now = datetime.datetime.now()
+log_entries = [f"Recorded FID {fid} as recently active at {now}" for fid in active_fids]
+for log_entry in log_entries:
+    log.debug(log_entry)
+
+# Move the high-water mark past the casts we just processed and close the connection
+if casts:
+    db.set_poll_state(conn, "recentfetch", casts[0].get('timestamp'), casts[0].get('hash'))
 conn.close()
 
 # Optionally, write the log entries to a file
@@ -41,4 +44,4 @@ with open('database_update_log.txt', 'a') as log_file:
     for entry in log_entries:
         log_file.write(entry + '\n')
 
-print("Database updated with recently active users. Log entries have been recorded.")
+log.info("Database updated with %d recently active users. Log entries have been recorded.", len(log_entries))
@@ -0,0 +1,93 @@
+import heapq
+import os
+import time
+
+import numpy as np
+
+import neynar
+
+# Orders follow and like candidates by how likely they are to follow back, so a rate-limited
+# budget goes to the best accounts first. Candidate columns are loaded from users (and activity)
+# into arrays and scored in one vectorized pass:
+#   ratio    following / followers, capped at RATIO_CAP: accounts that follow more than they're
+#            followed tend to follow back
+#   recency  decays by half every RECENCY_HALF_LIFE_HOURS since we last saw them react
+#   active   activeStatus == 'active'
+
+WEIGHTS = {
+    "ratio": float(os.getenv("SCORE_WEIGHT_RATIO", 0.5)),
+    "recency": float(os.getenv("SCORE_WEIGHT_RECENCY", 0.3)),
+    "active": float(os.getenv("SCORE_WEIGHT_ACTIVE", 0.2)),
+}
+RATIO_CAP = 3.0
+RECENCY_HALF_LIFE_HOURS = float(os.getenv("SCORE_RECENCY_HALF_LIFE_HOURS", 24))
+
+# Follows and likes sent per run, best candidates first (0 = no cap)
+FOLLOW_BUDGET = int(os.getenv("FOLLOW_BUDGET", 0))
+LIKE_BUDGET = int(os.getenv("LIKE_BUDGET", 0))
+
+# fid lookups go through the primary key; users never seen reacting have no activity row
+FEATURES_SQL = '''
+SELECT users.fid, follower_count, following_count, activeStatus, activity.last_seen_at
+FROM users LEFT JOIN activity ON activity.fid = users.fid
+WHERE users.fid IN ({})
+'''
+
+
+# Feature rows for `fids`, looked up 500 at a time
+def load_features(conn, fids):
+    rows = []
+    for chunk in neynar.chunked(fids, 500):
+        rows.extend(conn.execute(FEATURES_SQL.format(", ".join("?" * len(chunk))), chunk))
+    return rows
+
+
+# Score feature rows in one pass; returns (fids, scores) arrays. Missing counts and timestamps count as 0.
+def score(rows, now=None):
+    now = now or time.time()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    fids, followers, following, status, last_seen = zip(*rows)
+    followers = np.array(followers, dtype=float)
+    following = np.array(following, dtype=float)
+    last_seen = np.array(last_seen, dtype=float)
+    followers, following = np.nan_to_num(followers), np.nan_to_num(following)
+
+    ratio = np.minimum(following / (followers + 1), RATIO_CAP) / RATIO_CAP
+    age_hours = (now - last_seen) / 3600
+    recency = np.where(np.isnan(age_hours), 0.0, np.exp2(-np.maximum(age_hours, 0) / RECENCY_HALF_LIFE_HOURS))
+    active = np.array([value == 'active' for value in status], dtype=float)
+
+    scores = WEIGHTS["ratio"] * ratio + WEIGHTS["recency"] * recency + WEIGHTS["active"] * active
+    return np.array(fids, dtype=np.int64), scores
+
+
+# Max-priority queue of candidates; ties go to the lower FID
+class CandidateQueue:
+    def __init__(self):
+        self.heap = []
+
+    def push_many(self, fids, scores):
+        for fid, value in zip(fids.tolist(), scores.tolist()):
+            self.heap.append((-value, fid))
+        heapq.heapify(self.heap)
+
+    # Remove and return up to `count` of the best FIDs
+    def pop(self, count=1):
+        return [heapq.heappop(self.heap)[1] for _ in range(min(count, len(self.heap)))]
+
+    def __len__(self):
+        return len(self.heap)
+
+
+# Score `fids` and queue them best first. FIDs without a users row are left out.
+def rank(conn, fids, now=None):
+    queue = CandidateQueue()
+    queue.push_many(*score(load_features(conn, fids), now))
+    return queue
+
+
+# The best `budget` of `fids` (all of them when budget is 0), best first
+def best(conn, fids, budget=0, now=None):
+    queue = rank(conn, fids, now)
+    return queue.pop(budget or len(queue))
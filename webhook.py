@@ -0,0 +1,173 @@
+from dotenv import load_dotenv
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import actions
+import cronfollow
+import db
+import metrics
+import pipeline
+
+# Optional long-running receiver for Neynar webhooks. Signed cast.created and reaction.created
+# events are recorded in the activity table and their FIDs go straight into cronfollow's
+# profile -> cast -> follow -> like stages, so a reaction is acted on within seconds instead of
+# at the next recent-casts poll (run cronfollow with ACTIVITY_POLL_MINUTES=0 alongside this).
+# Try it locally with a signed sample payload:
+#   body='{"type":"reaction.created","data":{"user":{"fid":3},"cast":{"hash":"0xabc"}}}'
+#   sig=$(printf %s "$body" | openssl dgst -sha512 -hmac "$NEYNAR_WEBHOOK_SECRET" | cut -d' ' -f2)
+#   curl -H "X-Neynar-Signature: $sig" -d "$body" http://127.0.0.1:8788/webhook
+
+# Load environment variables from .env file
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+WEBHOOK_SECRET = os.getenv("NEYNAR_WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8788))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+SIGNATURE_HEADER = "X-Neynar-Signature"
+MAX_BODY_BYTES = 1024 * 1024
+
+# Events waiting for the pipeline; when full the receiver answers 503 and Neynar retries later
+EVENT_QUEUE_SIZE = 10000
+
+# A FID seen again within this many seconds only refreshes its activity row
+DEDUPE_SECONDS = int(os.getenv("WEBHOOK_DEDUPE_SECONDS", 300))
+
+# How often the opt-out set and the action ledger pick up changes made by other processes
+RELOAD_SECONDS = 300
+
+
+# The signature is the hex HMAC-SHA512 of the raw body, keyed with the webhook's shared secret
+def sign(body, secret):
+    return hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+
+
+def verify(body, signature, secret):
+    return bool(signature) and hmac.compare_digest(sign(body, secret), signature)
+
+
+# fid -> cast hash for the users an event shows as active: the author of a new cast, or the
+# user who reacted to a cast. Other event types carry no activity.
+def activity_from_event(event):
+    data = event.get('data') or {}
+    if event.get('type') == 'cast.created' and data.get('author', {}).get('fid'):
+        return {data['author']['fid']: data.get('hash')}
+    if event.get('type') == 'reaction.created' and data.get('user', {}).get('fid'):
+        return {data['user']['fid']: (data.get('cast') or {}).get('hash')}
+    return {}
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split("?")[0] != WEBHOOK_PATH:
+            return self.respond(404, {"error": "not found"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return self.respond(413, {"error": "body too large"})
+        body = self.rfile.read(length)
+        if not verify(body, self.headers.get(SIGNATURE_HEADER), self.server.secret):
+            metrics.inc("webhook_events_total", status="unauthorized")
+            return self.respond(401, {"error": "bad signature"})
+        try:
+            event = json.loads(body)
+        except ValueError:
+            metrics.inc("webhook_events_total", status="invalid")
+            return self.respond(400, {"error": "invalid JSON"})
+
+        activity = activity_from_event(event)
+        if activity:
+            try:
+                self.server.events.put_nowait(activity)
+            except queue.Full:
+                metrics.inc("webhook_events_total", type=event.get('type'), status="busy")
+                return self.respond(503, {"error": "busy"})
+        metrics.inc("webhook_events_total", type=event.get('type'), status="accepted" if activity else "ignored")
+        self.respond(200, {"accepted": len(activity)})
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve the webhook endpoint from a background thread; verified events are put on `events`
+def serve(events, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET):
+    server = ThreadingHTTPServer(("0.0.0.0", port), WebhookHandler)
+    server.daemon_threads = True
+    server.secret = secret
+    server.events = events
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    return server
+
+
+# Pipeline source: record every event's users as active and pass on the ones not seen within
+# DEDUPE_SECONDS. Never ends; the pipeline runs until the process is stopped.
+def received_fids(events, writer, dedupe_seconds=DEDUPE_SECONDS):
+    recent = {}
+    while True:
+        activity = events.get()
+        db.record_activity(writer, activity)
+        now = time.monotonic()
+        for fid, cast_hash in activity.items():
+            if now - recent.get(fid, -dedupe_seconds) >= dedupe_seconds:
+                recent[fid] = now
+                yield fid, cast_hash
+        if len(recent) > EVENT_QUEUE_SIZE * 10:
+            recent = {fid: seen for fid, seen in recent.items() if now - seen < dedupe_seconds}
+
+
+# Keep the opt-out set and the ledger current while the receiver runs, on a connection of its own
+def reload_forever(opt_out_fids, ledger, interval=RELOAD_SECONDS):
+    while True:
+        time.sleep(interval)
+        conn = db.connect()
+        try:
+            opt_out_fids.update(row[0] for row in conn.execute(db.OPT_OUT_SQL))
+            ledger.refresh(conn)
+        finally:
+            conn.close()
+
+def main():
+    metrics.start()
+    if not WEBHOOK_SECRET:
+        raise SystemExit("Set NEYNAR_WEBHOOK_SECRET to the webhook's shared secret.")
+
+    # Initialize Database Connection; this thread applies every write the pipeline makes
+    conn = db.connect()
+    db.migrate(conn)
+    writer = db.WriteBuffer(conn)
+    ledger = actions.Ledger(conn)
+    opt_out_fids = cronfollow.load_opt_out_fids(conn)
+    threading.Thread(target=reload_forever, args=(opt_out_fids, ledger), name="reload", daemon=True).start()
+
+    events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+    flow = pipeline.Pipeline()
+    active_fids = flow.queue()
+    flow.source("webhook", lambda: received_fids(events, flow.writer), active_fids)
+    cronfollow.add_activity_stages(flow, active_fids, cronfollow.client, cronfollow.signer_uuid, opt_out_fids, ledger)
+
+    server = serve(events)
+    log.info("Webhook receiver listening on port %d at %s.", WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        flow.run(writer)
+    except KeyboardInterrupt:
+        pass
+    server.shutdown()
+    writer.flush()
+    conn.close()
+
+if __name__ == "__main__":
+    main()